@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+KoeMojiAuto - ベンチマーク
+  engines : 同じ音声ファイルで sequential / batched の実時間係数（RTF）を比較
+  pipeline: 合成音声でスキャン→キュー→文字起こし→出力→アーカイブを通しで計測
+            （--stubでWhisperModelをスタブに差し替え、モデルなしでオーバーヘッドを計測）
+"""
+
+import os
+import sys
+import time
+import json
+import math
+import wave
+import random
+import shutil
+import struct
+import tempfile
+import argparse
+import threading
+from collections import namedtuple, defaultdict
+
+import koemoji
+
+#=======================================================================
+# 推論エンジンの比較
+#=======================================================================
+
+def measure_engine(engine, files):
+    """指定した推論エンジンで各ファイルを文字起こしし、処理時間を計測"""
+    koemoji.config["inference_engine"] = engine
+
+    # モデルロード時間は比較から除外する
+    load_start = time.time()
+    model = koemoji.get_whisper_model()
+    if model is None:
+        sys.exit("モデルをロードできませんでした")
+    load_time = time.time() - load_start
+
+    results = []
+    for file_path in files:
+        audio = koemoji.load_audio(file_path)
+        duration = len(audio) / koemoji.SAMPLE_RATE
+
+        start = time.time()
+        segments, _ = koemoji.get_transcriber(model).transcribe(
+            audio,
+            language=koemoji.config.get("language", "ja"),
+            **koemoji.get_decoding_options()
+        )
+        segment_count = sum(1 for _ in segments)  # ジェネレータを最後まで消費して推論させる
+        elapsed = time.time() - start
+
+        results.append({
+            "engine": engine,
+            "file": os.path.basename(file_path),
+            "audio_seconds": round(duration, 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "rtf": round(elapsed / duration, 4) if duration else None,
+            "segments": segment_count
+        })
+        print(f"  {engine:10} {os.path.basename(file_path)}: {elapsed:.2f}秒 / 音声{duration:.1f}秒 "
+              f"(RTF {elapsed / duration if duration else 0:.3f}, {segment_count}セグメント)")
+
+    return load_time, results
+
+def run_engines(args):
+    """engines: 推論エンジンごとのRTFを比較"""
+    koemoji.setup_logging()
+    koemoji.load_config()
+    if args.batch_size:
+        koemoji.config["batch_size"] = args.batch_size
+
+    print(f"モデル: {koemoji.config.get('whisper_model')} ({koemoji.config.get('compute_type')})")
+
+    all_results = []
+    summary = {}
+    for engine in args.engines:
+        print(f"\n[{engine}]")
+        load_time, results = measure_engine(engine, args.files)
+        all_results.extend(results)
+
+        total_audio = sum(r["audio_seconds"] for r in results)
+        total_elapsed = sum(r["elapsed_seconds"] for r in results)
+        summary[engine] = {
+            "model_load_seconds": round(load_time, 2),
+            "audio_seconds": round(total_audio, 2),
+            "elapsed_seconds": round(total_elapsed, 2),
+            "rtf": round(total_elapsed / total_audio, 4) if total_audio else None
+        }
+
+    print("\n--- 集計 ---")
+    for engine, stats in summary.items():
+        print(f"{engine:10} RTF {stats['rtf']} (処理{stats['elapsed_seconds']}秒 / 音声{stats['audio_seconds']}秒)")
+
+    if "sequential" in summary and "batched" in summary and summary["batched"]["rtf"]:
+        print(f"batchedの速度: sequentialの{summary['sequential']['rtf'] / summary['batched']['rtf']:.2f}倍")
+
+    return {"summary": summary, "results": all_results}
+
+#=======================================================================
+# パイプライン全体の計測
+#=======================================================================
+
+StubSegment = namedtuple("StubSegment", "start end text avg_logprob compression_ratio no_speech_prob")
+StubInfo = namedtuple("StubInfo", "duration language")
+
+class StubWhisperModel:
+    """WhisperModelの代わりに、音声の長さ × RTF だけ待ってダミーのセグメントを返すスタブ"""
+
+    def __init__(self, rtf, load_seconds):
+        self.rtf = rtf
+        time.sleep(load_seconds)  # モデルロード時間の模擬
+
+    def transcribe(self, audio, language=None, **kwargs):
+        if isinstance(audio, str):
+            duration = wav_duration(audio)
+        else:
+            duration = len(audio) / koemoji.SAMPLE_RATE
+
+        def generate():
+            # 10秒ごとに1セグメント、推論時間は音声の長さに比例させる
+            segment_count = max(1, math.ceil(duration / 10))
+            for index in range(segment_count):
+                start = index * 10.0
+                end = min(duration, start + 10.0)
+                time.sleep((end - start) * self.rtf)
+                yield StubSegment(start, end, f"セグメント{index + 1}", -0.2, 1.3, 0.01)
+
+        return generate(), StubInfo(duration, language)
+
+def wav_duration(path):
+    """WAVファイルの長さ（秒）"""
+    with wave.open(path, 'rb') as w:
+        return w.getnframes() / w.getframerate()
+
+def generate_fixtures(folder, count, min_seconds, max_seconds, seed):
+    """合成音声（発話を模した断続的なトーン + 無音）のWAVを生成"""
+    rng = random.Random(seed)
+    total_seconds = 0.0
+    for index in range(count):
+        duration = rng.uniform(min_seconds, max_seconds)
+        frames = int(duration * koemoji.SAMPLE_RATE)
+        frequency = rng.uniform(120, 300)
+
+        samples = bytearray()
+        for i in range(frames):
+            t = i / koemoji.SAMPLE_RATE
+            voiced = int(t) % 3 != 2  # 2秒鳴らして1秒無音
+            value = int(8000 * math.sin(2 * math.pi * frequency * t)) if voiced else 0
+            samples += struct.pack('<h', value)
+
+        path = os.path.join(folder, f"fixture_{index:03d}.wav")
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(koemoji.SAMPLE_RATE)
+            w.writeframes(bytes(samples))
+        total_seconds += duration
+
+    return total_seconds
+
+def instrument(stage_times, name, func):
+    """関数の実行時間をstage_timesに積算するラッパー"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with koemoji.stats_lock:
+                stage_times[name]["count"] += 1
+                stage_times[name]["seconds"] += elapsed
+    return wrapper
+
+def sample_peak_rss(stop_event, result):
+    """RSSを定期的に測ってピークを記録"""
+    try:
+        import psutil
+    except ImportError:
+        return
+    process = psutil.Process()
+    while not stop_event.is_set():
+        result["peak_rss"] = max(result["peak_rss"], process.memory_info().rss)
+        stop_event.wait(0.1)
+
+def run_pipeline(args):
+    """pipeline: 合成音声をスキャン→処理→アーカイブまで通しで計測"""
+    workspace = tempfile.mkdtemp(prefix="koemoji_bench_")
+    try:
+        os.chdir(workspace)
+        koemoji.setup_logging(os.path.join(workspace, "koemoji.log"))
+
+        koemoji.config = koemoji.DEFAULT_CONFIG.copy()
+        if args.config:
+            with open(args.config, 'r', encoding='utf-8') as f:
+                koemoji.config.update(json.load(f))
+        koemoji.config.update({
+            "input_folder": os.path.join(workspace, "input"),
+            "output_folder": os.path.join(workspace, "output"),
+            "archive_folder": os.path.join(workspace, "archive"),
+            "job_db": os.path.join(workspace, "jobs.db"),
+            "watch_mode": "poll",
+            "file_settle_seconds": 0,  # フィクスチャは書き込み済みなので完了待ちは不要
+            "transcript_cache": args.cache,
+            "max_workers": args.workers
+        })
+        for folder_key in ["input_folder", "output_folder", "archive_folder"]:
+            koemoji.ensure_directory(koemoji.config[folder_key])
+
+        audio_seconds = generate_fixtures(koemoji.config["input_folder"], args.files,
+                                          args.min_seconds, args.max_seconds, args.seed)
+        if args.duplicates:
+            # 同じ内容のファイルを追加してキャッシュの効果を見る
+            for index in range(args.duplicates):
+                source = os.path.join(koemoji.config["input_folder"], f"fixture_{index % args.files:03d}.wav")
+                shutil.copy(source, os.path.join(koemoji.config["input_folder"], f"duplicate_{index:03d}.wav"))
+                audio_seconds += wav_duration(source)
+
+        if args.stub:
+            koemoji.create_whisper_model = lambda *_: StubWhisperModel(args.stub_rtf, args.stub_load_seconds)
+
+        # 各段階の処理時間を計測
+        stage_times = defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        for name in ["scan_and_queue_files", "get_whisper_model", "load_audio", "get_cache_key",
+                     "transcribe_audio", "safe_move_file", "process_file"]:
+            setattr(koemoji, name, instrument(stage_times, name, getattr(koemoji, name)))
+
+        rss = {"peak_rss": 0}
+        stop_sampling = threading.Event()
+        sampler = threading.Thread(target=sample_peak_rss, args=(stop_sampling, rss), daemon=True)
+        sampler.start()
+
+        print(f"モデル: {'スタブ (RTF ' + str(args.stub_rtf) + ')' if args.stub else koemoji.config.get('whisper_model')} "
+              f"/ ファイル: {args.files + args.duplicates}件 / 音声: {audio_seconds / 60:.1f}分 / ワーカー: {args.workers}")
+
+        start = time.time()
+        koemoji.init_job_store()
+        koemoji.is_running = True
+        koemoji.stop_requested = False
+        koemoji.processing_started_at = start
+        koemoji.start_model_preload()
+        koemoji.scan_and_queue_files()
+        koemoji.start_prefetcher()
+
+        # ワーカー数分のスレッドでキューが空になるまで処理
+        def drain(worker_id):
+            while koemoji.process_next_file(worker_id) or koemoji.count_jobs("queued"):
+                pass
+
+        workers = [threading.Thread(target=drain, args=(i,)) for i in range(1, args.workers + 1)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        koemoji.is_running = False
+        stop_sampling.set()
+        sampler.join()
+
+        peak_rss = rss["peak_rss"]
+        try:
+            import resource
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak_rss = max(peak_rss, max_rss if sys.platform == "darwin" else max_rss * 1024)
+        except ImportError:
+            pass
+
+        done = koemoji.count_jobs("done")
+        summary = {
+            "files_done": done,
+            "files_failed": koemoji.count_jobs("failed"),
+            "audio_seconds": round(audio_seconds, 2),
+            "elapsed_seconds": round(elapsed, 3),
+            "files_per_hour": round(done / elapsed * 3600, 1) if elapsed else None,
+            "rtf": round(elapsed / audio_seconds, 4) if audio_seconds else None,
+            "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+            "stages": {name: {"count": v["count"], "seconds": round(v["seconds"], 3)}
+                       for name, v in stage_times.items()}
+        }
+
+        print("\n--- 集計 ---")
+        print(f"完了: {done}件 / 失敗: {summary['files_failed']}件 / 処理時間: {elapsed:.2f}秒")
+        print(f"スループット: {summary['files_per_hour']}件/時 / RTF: {summary['rtf']} / ピークRSS: {summary['peak_rss_mb']}MB")
+        print("\n--- 段階ごとの処理時間（合計） ---")
+        for name, stats in summary["stages"].items():
+            print(f"{name:22} {stats['seconds']:9.3f}秒 ({stats['count']}回)")
+
+        return {"summary": summary}
+    finally:
+        os.chdir(koemoji.BASE_DIR)
+        if not args.keep:
+            shutil.rmtree(workspace, ignore_errors=True)
+        else:
+            print(f"\n作業フォルダ: {workspace}")
+
+#=======================================================================
+# メイン実行部分
+#=======================================================================
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="KoeMojiAutoのベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engines = subparsers.add_parser("engines", help="推論エンジンのRTFを比較")
+    engines.add_argument("files", nargs="+", help="計測に使う音声・動画ファイル")
+    engines.add_argument("--engines", nargs="+", default=["sequential", "batched"],
+                         choices=["sequential", "batched"], help="比較する推論エンジン")
+    engines.add_argument("--batch-size", type=int, help="batched時のバッチサイズ（省略時はconfig.jsonの値）")
+
+    pipeline = subparsers.add_parser("pipeline", help="合成音声でパイプライン全体を計測")
+    pipeline.add_argument("--stub", action="store_true", help="WhisperModelをスタブに差し替える")
+    pipeline.add_argument("--stub-rtf", type=float, default=0.05, help="スタブの実時間係数")
+    pipeline.add_argument("--stub-load-seconds", type=float, default=0.5, help="スタブのモデルロード時間")
+    pipeline.add_argument("--files", type=int, default=20, help="生成する音声ファイル数")
+    pipeline.add_argument("--duplicates", type=int, default=0, help="内容が同じファイルの追加数")
+    pipeline.add_argument("--min-seconds", type=float, default=5, help="音声の最短の長さ")
+    pipeline.add_argument("--max-seconds", type=float, default=60, help="音声の最長の長さ")
+    pipeline.add_argument("--seed", type=int, default=0, help="乱数シード（同じ値なら同じ音声を生成）")
+    pipeline.add_argument("--workers", type=int, default=1, help="ワーカー数")
+    pipeline.add_argument("--cache", action="store_true", help="文字起こしキャッシュを有効にする")
+    pipeline.add_argument("--config", help="上書きする設定（JSONファイル）")
+    pipeline.add_argument("--keep", action="store_true", help="作業フォルダを削除しない")
+
+    for subparser in (engines, pipeline):
+        subparser.add_argument("--json", help="結果をJSONで保存するパス")
+
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    if args.command == "engines":
+        result = run_engines(args)
+    else:
+        result = run_pipeline(args)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"結果を保存しました: {args.json}")
+
+if __name__ == "__main__":
+    main()
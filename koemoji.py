@@ -9,14 +9,31 @@ KoeMojiAuto - 自動文字起こしシステム (統合版 - シンプルモデ
 import os
 import sys
 import time
+import copy
 import json
 import logging
+import logging.handlers
+import queue
+import atexit
 import shutil
 import threading
+import contextlib
+import socket
+import signal
+import argparse
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
 import platform
+import select
+import errno
+import struct
+import sqlite3
+import hashlib
+import uuid
 import psutil
 from pathlib import Path
-from collections import deque
+from collections import OrderedDict
 
 # Windowsかどうかを判定
 IS_WINDOWS = platform.system() == 'Windows'
@@ -24,14 +41,75 @@ IS_WINDOWS = platform.system() == 'Windows'
 # グローバル変数
 config = {}
 logger = None
-processing_queue = []
-whisper_model = None
-model_config = None  # (model_size, compute_type)のタプルまたはNone
+log_listener = None  # ログをファイルに書き込むスレッド（ワーカーはキューに積むだけ）
+log_path = 'koemoji.log'
+job_db = None  # ジョブストア（SQLite）の接続
+model_pool = OrderedDict()  # (model_size, compute_type, レプリカ数, スレッド数) -> WhisperModel（末尾ほど最近使用）
+model_preload_thread = None
 
 # 実行状態を管理するグローバル変数
 is_running = False
 stop_requested = False
 processing_thread = None
+is_paused = False    # 一時停止中（実行中のジョブは続行し、新しいジョブを開始しない）
+is_draining = False  # キューを処理しきったら終了（新しいファイルは受け付けない）
+control_server = None  # 制御用のUnixソケットサーバー
+
+# ワーカー関連のグローバル変数
+job_db_lock = threading.RLock()  # ジョブストアへのアクセスの排他制御
+job_finished_cond = threading.Condition()  # ジョブの完了・失敗を待つ（HTTP APIのロングポーリング用）
+stats_lock = threading.Lock()    # 集計値の更新の排他制御
+cache_stats = {"hit": 0, "miss": 0}  # 文字起こしキャッシュのヒット・ミス件数
+model_lock = threading.Lock()    # モデルプールの排他制御（ロード自体はロックの外で行う）
+model_loading = {}              # ロード中のモデルのキー -> ロード完了を知らせるEvent
+worker_threads = []
+worker_status = {}              # ワーカーID -> 状態表示文字列
+completed_count = 0             # 処理開始以降の完了件数
+processing_started_at = None
+queue_event = threading.Event()  # キュー追加時にワーカーを起こす
+prefetch_event = threading.Event()  # キューの変化時に先読みスレッドを起こす
+prefetch_cond = threading.Condition()  # 先読みキャッシュの保護とデコード完了の通知
+prefetch_cache = OrderedDict()  # パス -> (元ファイルの識別情報, デコード済み音声)
+prefetch_inflight = set()  # デコード中のパス
+prefetch_failed = {}  # デコードに失敗したパス -> 元ファイルの識別情報（ファイルが変わるまで再試行しない）
+prefetch_thread = None
+http_server = None  # ローカルHTTPサーバー（/metrics など）
+resource_lock = threading.Lock()  # リソース使用状況の保護
+resource_snapshot = {}  # サンプラーが更新する平滑化済みのCPU・メモリ・ロードアベレージ
+resource_sampler_thread = None
+pending_lock = threading.Lock()  # 書き込み完了待ちのファイルの保護
+pending_files = {}  # パス -> 書き込み完了待ちの観測状態（size, mtime_ns, changed_at, unstable）
+cluster_node_id = None  # クラスタモードでのこのノードのID
+cluster_thread = None
+admission_denied_since = {}  # ワーカーID -> 実行を見送り始めた時刻
+memory_held_model = None  # 空きメモリ不足でロードできなかったモデル（収まるまで新しいジョブを開始しない）
+batched_engine_unavailable = False  # faster-whisperが古くbatchedを使えない（警告済み）
+thread_tuning = None  # スレッド数の自動調整結果（{"workers", "cpu_threads", ...}）
+trace_local = threading.local()  # ワーカースレッドごとの処理中ジョブのトレース
+trace_lock = threading.Lock()    # トレースファイルへの書き込みの排他制御
+profile_lock = threading.Lock()  # cProfileは同時に1つしか有効にできない（Python 3.12以降）
+watcher_thread = None
+inotify_fd = None  # フォルダ監視のinotify（監視していなければNone）
+inotify_libc = None
+inotify_lock = threading.Lock()  # 監視中のフォルダの対応表の保護
+inotify_watches = {}  # ウォッチ記述子 -> フォルダ
+inotify_folders = {}  # フォルダ -> ウォッチ記述子
+inotify_limit_warned = False  # 監視数の上限に達したことを警告済み
+
+# Whisperに渡す音声のサンプリングレート
+SAMPLE_RATE = 16000
+
+# モデルごとのおおよその必要メモリ（MB、float16/float32時。int8系はこの半分で見積もる）
+MODEL_MEMORY_MB = {
+    "tiny": 500,
+    "base": 700,
+    "small": 2000,
+    "medium": 5000,
+    "large": 10000
+}
+
+# 処理対象のメディアファイル拡張子
+MEDIA_EXTENSIONS = ('.mp3', '.mp4', '.wav', '.m4a', '.mov', '.avi', '.flac', '.ogg', '.aac')
 
 # 実行ディレクトリをベースディレクトリとして使用
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -42,10 +120,64 @@ DEFAULT_CONFIG = {
     "output_folder": os.path.join(BASE_DIR, "output"), 
     "archive_folder": os.path.join(BASE_DIR, "archive"),
     "scan_interval_minutes": 30,
+    "file_settle_seconds": 10,  # サイズ・更新時刻がこの秒数変化しなくなってからキューに追加（コピー中のファイル対策、0で無効）
+    "watch_mode": "auto",  # auto: inotify監視（Linux）+定期スキャン / poll: 定期スキャンのみ
     "whisper_model": "large",
     "language": "ja",
     "max_cpu_percent": 95,
+    "min_free_memory_mb": 1024,  # 新しいジョブ・モデルロード後にも残しておく空きメモリ
+    "max_load_per_core": 0,  # 1分間のロードアベレージ/コア数がこれを超えたら新しいジョブを待たせる（0で無効）
+    "resource_sample_interval": 1.0,  # リソース使用状況を測定する間隔（秒）
+    "resource_smoothing": 0.3,  # 測定値の平滑化係数（大きいほど直近の値を重視）
     "compute_type": "int8",  # CPUでの高速処理（GPUある場合は"auto"推奨）
+    "inference_engine": "sequential",  # sequential: 従来の逐次推論 / batched: バッチ推論
+    "decoding_mode": "beam",  # beam: 全区間ビームサーチ / two_pass: グリーディ後、確信度の低い区間のみビームサーチ
+    "two_pass_logprob_threshold": -0.8,  # two_pass時、平均対数確率がこれ未満の区間を再推論
+    "two_pass_compression_ratio_threshold": 2.2,  # two_pass時、圧縮率がこれを超える区間を再推論
+    "two_pass_beam_size": 5,  # two_pass時の再推論のビーム幅
+    "batch_size": 8,  # batched時に1回の推論でまとめる区間数
+    "model_store": os.path.join(BASE_DIR, "models"),  # 変換済みモデルの保存先（--import-modelで取り込み、空で無効）
+    "model_store_keep_versions": 2,  # モデルストアに残すバージョン数（モデル・compute_typeごと）
+    "preload_model": True,  # 処理開始と同時にバックグラウンドでモデルを読み込む
+    "model_pool_max_mb": 12000,  # 同時に保持するモデルのメモリ上限（超えたら古い順に解放）
+    "turnaround_target_hours": 0,  # 待機中のファイルをこの時間内に処理しきれるようモデルを自動選択（0で無効）
+    "adaptive_models": ["large", "medium", "small"],  # 自動選択の候補（精度の高い順）
+    "queue_order": "shortest_first",  # shortest_first: 短い音声から処理 / fifo: 見つけた順
+    "priority_aging": 1.0,  # 待ち時間1秒ごとに上がる優先度（秒換算、長いファイルの後回し防止）
+    "folder_priorities": {},  # サブフォルダごとの優先度（秒換算、例: {"urgent": 3600}）
+    "prefetch_files": 2,  # 推論中に先読み（デコード）しておく次のファイル数（0で無効）
+    "prefetch_max_mb": 512,  # 先読みした音声に使うメモリの上限
+    "http_host": "127.0.0.1",  # ローカルHTTPサーバーの待ち受けアドレス
+    "control_socket": "" if IS_WINDOWS else os.path.join(BASE_DIR, "koemoji.sock"),  # 制御用Unixソケット（空で無効、Windowsでは使用不可）
+    "upload_folder": os.path.join(BASE_DIR, "uploads"),  # HTTP APIで受け取ったファイルの保存先
+    "upload_max_mb": 2048,  # HTTP APIで受け付けるファイルサイズの上限
+    "http_port": 0,  # ローカルHTTPサーバーのポート（/metrics を公開、0で無効）
+    "trace_file": "",  # ジョブごとの段階別処理時間を追記するJSONLファイル（空で無効）
+    "profile_dir": "",  # ジョブごとのcProfile結果（.prof）を保存するフォルダ（空で無効）
+    "thread_tuning": "off",  # auto: 初回にワーカー数・スレッド数の組み合わせを計測して最適な値を使う
+    "thread_tuning_file": os.path.join(BASE_DIR, "thread_tuning.json"),  # 自動調整結果の保存先
+    "pin_workers": False,  # ワーカースレッドを互いに重ならないCPUコアに固定（Linuxのみ）
+    "max_workers": 1,  # 同時に文字起こしするファイル数（1で従来通りの逐次処理）
+    "silence_prepass": False,  # Whisperの前に音量・VADで無音を判定（無音ファイルはモデルを使わずに空の結果、前後の長い無音は除外）
+    "silence_threshold_db": -50,  # 音量の最大値がこれ未満のファイルはVADを使わずに無音と判定
+    "silence_trim_min_seconds": 30,  # 先頭・末尾の無音がこの秒数以上のときだけ切り詰める
+    "silence_margin_seconds": 1.0,  # 切り詰めるときに発話の前後に残す秒数
+    "chunked_transcription": False,  # 長時間の録音を分割して並列に文字起こし
+    "chunk_min_minutes": 20,  # この長さ以上の録音を分割対象にする
+    "chunk_seconds": 600,  # 1チャンクの目標の長さ
+    "chunk_overlap_seconds": 2,  # 無音で区切れない場合のチャンクの重なり
+    "chunk_parallelism": 0,  # 同時に文字起こしするチャンク数（0で使えるコア数の半分、最低でもワーカー数）
+    "job_db": os.path.join(BASE_DIR, "koemoji_jobs.db"),  # ジョブの状態を保存するDB
+    "cluster_mode": False,  # 複数のマシンで同じ入力・出力・アーカイブフォルダを共有して分担処理
+    "node_id": "",  # クラスタ内でのノード名（空ならホスト名-プロセスID）
+    "lease_seconds": 120,  # この秒数ハートビートが更新されないノードの処理中ファイルを取り戻す
+    "job_max_attempts": 3,  # 失敗したファイルを再試行する上限回数
+    "transcript_cache": True,  # 同じ内容のファイルは過去の文字起こし結果を再利用
+    "transcript_cache_max_mb": 200,  # キャッシュの上限サイズ（超えたら古い順に削除）
+    "log_rotation": "size",  # size: サイズで切り替え / time: 日時で切り替え / off: 切り替えない
+    "log_max_mb": 10,  # size時、ログファイルを切り替えるサイズ
+    "log_rotate_when": "midnight",  # time時の切り替えタイミング（midnight: 毎日0時、W0: 毎週月曜など）
+    "log_backup_count": 5,  # 残しておく古いログファイルの数
     "auto_start": False
 }
 
@@ -53,12 +185,32 @@ DEFAULT_CONFIG = {
 # ロギング・ユーティリティ関数
 #=======================================================================
 
+def create_log_file_handler(log_file):
+    """ログファイルのハンドラを作成（設定に応じてサイズ・日時で切り替える）"""
+    rotation = config.get("log_rotation", DEFAULT_CONFIG["log_rotation"])
+    backup_count = config.get("log_backup_count", DEFAULT_CONFIG["log_backup_count"])
+    
+    if rotation == "size":
+        max_bytes = int(config.get("log_max_mb", DEFAULT_CONFIG["log_max_mb"]) * 1024 * 1024)
+        return logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                    backupCount=backup_count, encoding='utf-8')
+    if rotation == "time":
+        when = config.get("log_rotate_when", DEFAULT_CONFIG["log_rotate_when"])
+        return logging.handlers.TimedRotatingFileHandler(log_file, when=when,
+                                                         backupCount=backup_count, encoding='utf-8')
+    return logging.FileHandler(log_file, encoding='utf-8')
+
 def setup_logging(log_file='koemoji.log', level=logging.INFO):
-    """ロギングの設定"""
-    global logger
+    """ロギングの設定（設定読み込み後に再度呼ぶとローテーション設定が反映される）
     
-    # ハンドラを直接作成してエンコーディングを指定
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
+    ファイルへの書き込みは専用スレッドで行い、ワーカーはキューに積むだけにする。
+    """
+    global logger, log_listener, log_path
+    
+    # 前回のリスナーを止めて、溜まっているログを書き出す
+    stop_logging()
+    
+    file_handler = create_log_file_handler(log_file)
     file_handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s', '%Y-%m-%d %H:%M'))
     
     # ロガーの設定
@@ -69,11 +221,28 @@ def setup_logging(log_file='koemoji.log', level=logging.INFO):
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
     
-    # 新しいハンドラを追加
-    logger.addHandler(file_handler)
+    # ロガーはキューに積み、リスナーのスレッドがファイルに書き込む
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    log_listener.start()
+    log_path = log_file
     
     return logger
 
+def stop_logging():
+    """ログのリスナーを止める（キューに残ったログは書き出してから止まる）"""
+    global log_listener
+    
+    if log_listener is None:
+        return
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    log_listener = None
+
+atexit.register(stop_logging)
+
 def log_and_print(message, level="info", category=None, print_console=True):
     """ログとコンソールの両方に出力（print_console=Falseでログのみ）
     
@@ -173,15 +342,29 @@ def load_config(config_path="config.json"):
         log_and_print(f"設定の読み込み中にエラーが発生しました: {e}", "error")
         config = DEFAULT_CONFIG.copy()
 
+# 初期バージョンからある基本の設定項目（欠けていれば警告する）
+# それ以外は後のバージョンで追加した項目で、既存の設定ファイルにないのが普通なので既定値を黙って補う
+REQUIRED_CONFIG_KEYS = ("input_folder", "output_folder", "archive_folder", "scan_interval_minutes",
+                        "whisper_model", "language", "max_cpu_percent", "compute_type", "auto_start")
+
 def validate_config():
     """設定値の妥当性をチェック"""
     global config
     
     # 必須項目がない場合はデフォルト値を設定
+    added = []
     for key, default in DEFAULT_CONFIG.items():
         if key not in config:
-            log_and_print(f"必須設定 '{key}' が見つかりません。デフォルト値 '{default}' を使用します。", "warning")
+            if key in REQUIRED_CONFIG_KEYS:
+                log_and_print(f"必須設定 '{key}' が見つかりません。デフォルト値 '{default}' を使用します。", "warning")
+            else:
+                logger.debug(f"設定 '{key}' がないため既定値 '{default}' を使用します")
+                added.append(key)
             config[key] = default
+    
+    if added:
+        log_and_print(f"設定ファイルにない{len(added)}項目は既定値を使用します（設定例はconfig.sampleを参照）",
+                      print_console=False)
 
 def save_config(config_path="config.json"):
     """設定ファイルを保存"""
@@ -204,349 +387,3335 @@ def save_config(config_path="config.json"):
             os.remove(temp_path)
 
 #=======================================================================
-# 文字起こし処理
+# ジョブストア（SQLite）
 #=======================================================================
 
-def transcribe_audio(file_path):
-    """音声ファイルを文字起こし"""
-    global whisper_model, model_config, stop_requested
+# state: queued（待機中） / running（処理中） / done（完了） / failed（失敗）
+#        skipped（クラスタモードで他のノードが先に確保した）
+JOB_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    source TEXT,
+    dropped_at REAL,
+    detected_at REAL,
+    queued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    output_path TEXT,
+    error TEXT,
+    duration REAL,
+    model TEXT,
+    rtf REAL,
+    priority REAL NOT NULL DEFAULT 0
+);
+-- 同じパスの未完了ジョブは1件だけ（重複登録の防止を索引で保証）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_path ON jobs(path) WHERE state IN ('queued', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_path ON jobs(path);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, id);
+
+-- 文字起こしキャッシュ（key: ファイル内容のハッシュ + モデル・デコード設定）
+CREATE TABLE IF NOT EXISTS transcript_cache (
+    key TEXT PRIMARY KEY,
+    transcript TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_cache_last_used ON transcript_cache(last_used);
+
+-- 入力フォルダの索引（前回スキャン時の状態。変化のあったフォルダだけ一覧を取り直す）
+CREATE TABLE IF NOT EXISTS scan_index (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    is_dir INTEGER NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    ctime_ns INTEGER,
+    inode INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_scan_index_parent ON scan_index(parent);
+"""
+
+# 既存のDBに後から追加した列（列名, 型）
+JOB_DB_ADDED_COLUMNS = [
+    ("duration", "REAL"),  # 音声の長さ（秒）
+    ("model", "TEXT"),     # 文字起こしに使ったモデル
+    ("rtf", "REAL"),       # 実時間係数（処理時間 / 音声の長さ）
+    ("priority", "REAL NOT NULL DEFAULT 0")  # フォルダごとの優先度（秒換算）
+]
+
+def migrate_job_store(conn):
+    """古いDBに不足している列と索引を追加"""
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    for column, column_type in JOB_DB_ADDED_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_model ON jobs(model, id)")
     
-    # 停止要求をチェック（この関数の先頭で確認）
-    if stop_requested:
-        log_and_print("停止要求を検出したため、文字起こしをキャンセルします", "info", print_console=False)
-        return None
+    # 入力フォルダの索引：renameで出入りしたファイルを検出するためctimeも記録する
+    scan_columns = {row["name"] for row in conn.execute("PRAGMA table_info(scan_index)")}
+    if "ctime_ns" not in scan_columns:
+        conn.execute("ALTER TABLE scan_index ADD COLUMN ctime_ns INTEGER")
+
+def init_job_store(db_path=None):
+    """ジョブストアを開き、前回異常終了時に処理中だったジョブを待機中に戻す"""
+    global job_db
     
-    start_time = time.time()
-    file_name = os.path.basename(file_path)
+    db_path = db_path or config.get("job_db", DEFAULT_CONFIG["job_db"])
+    
+    with job_db_lock:
+        if job_db is not None:
+            return job_db
+        
+        ensure_directory(os.path.dirname(os.path.abspath(db_path)))
+        conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(JOB_DB_SCHEMA)
+        migrate_job_store(conn)
+        
+        # クラッシュ・Ctrl+Cで中断されたジョブを再開対象に戻す
+        recovered = conn.execute(
+            "UPDATE jobs SET state = 'queued', started_at = NULL WHERE state = 'running'"
+        ).rowcount
+        job_db = conn
+    
+    if recovered:
+        log_and_print(f"中断されていたジョブを{recovered}件再開します", category="キュー")
+    log_and_print(f"ジョブストアを開きました: {db_path} (待機中: {count_jobs('queued')}件)",
+                  category="キュー", print_console=False)
+    return job_db
+
+def count_jobs(state):
+    """指定した状態のジョブ数を取得"""
+    if job_db is None:
+        return 0
     
+    with job_db_lock:
+        row = job_db.execute("SELECT COUNT(*) FROM jobs WHERE state = ?", (state,)).fetchone()
+    return row[0]
+
+def get_latest_job(file_path):
+    """ファイルパスに対応する最新のジョブを取得（なければNone）"""
+    with job_db_lock:
+        row = job_db.execute(
+            "SELECT * FROM jobs WHERE path = ? ORDER BY id DESC LIMIT 1", (file_path,)
+        ).fetchone()
+    return dict(row) if row else None
+
+def insert_job(file_info):
+    """ジョブを待機中として登録（同じパスが待機中・処理中なら登録せずNone）"""
     try:
-        from faster_whisper import WhisperModel
-    except ImportError:
-        log_and_print("faster_whisperがインストールされていません。pip install faster-whisperを実行してください。", "error")
+        with job_db_lock:
+            cursor = job_db.execute(
+                "INSERT INTO jobs (path, name, size, state, source, dropped_at, detected_at, queued_at, duration, priority) "
+                "VALUES (:path, :name, :size, 'queued', :source, :dropped_at, :detected_at, :queued_at, :duration, :priority)",
+                file_info
+            )
+        return cursor.lastrowid
+    except sqlite3.IntegrityError:
         return None
+
+def requeue_job(job_id, count_attempt=True):
+    """ジョブを待機中に戻す（count_attempt=Falseなら試行回数を戻す）"""
+    with job_db_lock:
+        job_db.execute(
+            "UPDATE jobs SET state = 'queued', started_at = NULL, "
+            "attempts = attempts - ? WHERE id = ?",
+            (0 if count_attempt else 1, job_id)
+        )
+
+# 長さが取得できなかったファイルの長さの見積もり（128kbpsの音声相当）
+ESTIMATED_BYTES_PER_SECOND = 16000
+
+def select_queued_jobs(limit):
+    """待機中ジョブを処理する順に取得
     
-    try:
-        # モデルサイズを設定
-        model_size = config.get("whisper_model", "large")
-        compute_type = config.get("compute_type", "int8")  # config.jsonから読み込み
-        
-        # モデルが未ロードか設定が変わった場合のみ再ロード
-        if (whisper_model is None or 
-            model_config != (model_size, compute_type)):
-            # モデルロード前に再度停止要求をチェック
-            if stop_requested:
-                log_and_print("モデルロードをキャンセル（停止要求）", category="モデル", print_console=False)
-                return None
-                
-            log_and_print(f"モデルロード: Whisper {model_size} (compute_type: {compute_type})", category="モデル", print_console=False)
-            
-            # モデルをロード（config.jsonの設定を使用）
-            whisper_model = WhisperModel(model_size, compute_type=compute_type)
-            
-            model_config = (model_size, compute_type)
-            
-            # モデルロード後にも停止要求をチェック
-            if stop_requested:
-                log_and_print("処理をキャンセル（停止要求）", category="モデル", print_console=False)
-                return None
-        
-        # 文字起こし開始前に再度停止要求をチェック
-        if stop_requested:
-            log_and_print("処理をキャンセル（停止要求）", category="処理", print_console=False)
+    queue_orderがshortest_firstなら、音声の短いものから処理する。
+    長いファイルが後回しにされ続けないよう、待ち時間に比例して優先度を上げる（エージング）。
+    スコア = 音声の長さ - フォルダの優先度 - 待ち時間 × priority_aging（小さいほど先）
+    """
+    with job_db_lock:
+        if config.get("queue_order", "shortest_first") == "shortest_first":
+            rows = job_db.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' "
+                "ORDER BY COALESCE(duration, size * 1.0 / ?) - priority - ? * (? - queued_at), id LIMIT ?",
+                (ESTIMATED_BYTES_PER_SECOND, config.get("priority_aging", 1.0), time.time(), limit)
+            ).fetchall()
+        else:
+            rows = job_db.execute(
+                "SELECT * FROM jobs WHERE state = 'queued' ORDER BY id LIMIT ?", (limit,)
+            ).fetchall()
+    return [dict(row) for row in rows]
+
+def claim_next_job():
+    """次の待機中ジョブを処理中にして返す（なければNone）"""
+    with job_db_lock:
+        rows = select_queued_jobs(1)
+        row = rows[0] if rows else None
+        if row is None:
             return None
-            
-        log_and_print(f"音声認識開始: {file_name}", category="処理", print_console=False)
         
-        # 文字起こし実行
-        segments, info = whisper_model.transcribe(
-            file_path,
-            language=config.get("language", "ja"),
-            beam_size=5,
-            best_of=5,
-            vad_filter=True
+        started_at = time.time()
+        job_db.execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, started_at = ? WHERE id = ?",
+            (started_at, row["id"])
         )
-        
-        # セグメントをテキストに結合
-        transcription = []
-        segment_count = 0
-        
-        for segment in segments:
-            segment_count += 1
-            transcription.append(segment.text.strip())
-            
-            # 10セグメントごとに進捗をログに記録
-            if segment_count % 10 == 0:
-                log_and_print(f"進捗: {segment_count}セグメント処理済み", category="処理", print_console=False)
-        
-        # 処理時間を計算
-        processing_time = time.time() - start_time
-        log_and_print(f"文字起こし完了: {file_name} - 合計{segment_count}セグメント (処理時間: {processing_time:.2f}秒)")
-        
-        return "\n".join(transcription)
     
-    except Exception as e:
-        log_and_print(f"文字起こし処理中にエラーが発生しました: {e}", "error")
-        return None
+    job = row
+    job["state"] = "running"
+    job["attempts"] += 1
+    job["started_at"] = started_at
+    return job
+
+def get_job_state(job_id):
+    """ジョブの現在の状態"""
+    with job_db_lock:
+        row = job_db.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return row["state"] if row else None
+
+def get_job(job_id):
+    """ジョブの情報を取得（なければNone）"""
+    with job_db_lock:
+        row = job_db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return dict(row) if row else None
+
+def get_running_paths():
+    """処理中ジョブのパス一覧"""
+    with job_db_lock:
+        rows = job_db.execute("SELECT path FROM jobs WHERE state = 'running'").fetchall()
+    return {row["path"] for row in rows}
+
+def set_job_model(job_id, model_size):
+    """ジョブに使うモデルを記録"""
+    with job_db_lock:
+        job_db.execute("UPDATE jobs SET model = ? WHERE id = ?", (model_size, job_id))
+
+def set_job_rtf(job_id, rtf):
+    """ジョブの実時間係数を記録（キャッシュヒットなど実際に推論しなかった場合は記録しない）"""
+    with job_db_lock:
+        job_db.execute("UPDATE jobs SET rtf = ? WHERE id = ?", (rtf, job_id))
+
+def get_queued_audio_seconds():
+    """待機中ジョブの音声の長さの合計（秒、長さを取得できなかったファイルはサイズから見積もる）"""
+    with job_db_lock:
+        row = job_db.execute(
+            "SELECT COALESCE(SUM(COALESCE(duration, size * 1.0 / ?)), 0) FROM jobs WHERE state = 'queued'",
+            (ESTIMATED_BYTES_PER_SECOND,)
+        ).fetchone()
+    return row[0]
+
+def get_retryable_paths(max_attempts):
+    """最新のジョブが失敗で、試行回数が上限未満のファイルのパス"""
+    with job_db_lock:
+        rows = job_db.execute(
+            "SELECT path FROM jobs AS j WHERE state = 'failed' AND attempts < ? "
+            "AND id = (SELECT MAX(id) FROM jobs WHERE path = j.path)",
+            (max_attempts,)
+        ).fetchall()
+    return [row["path"] for row in rows]
+
+def finish_job(job_id, state, output_path=None, error=None):
+    """ジョブを完了（done）または失敗（failed）として記録"""
+    with job_db_lock:
+        job_db.execute(
+            "UPDATE jobs SET state = ?, finished_at = ?, output_path = ?, error = ? WHERE id = ?",
+            (state, time.time(), output_path, error, job_id)
+        )
+    
+    # 完了を待っているHTTPクライアントを起こす
+    with job_finished_cond:
+        job_finished_cond.notify_all()
 
 #=======================================================================
-# ファイル処理
+# 入力フォルダの索引
 #=======================================================================
 
-def scan_and_queue_files():
-    """入力フォルダをスキャンしてファイルをキューに追加"""
-    global processing_queue, stop_requested
+def get_scan_entry(path):
+    """索引に記録されたフォルダ・ファイルの状態（なければNone）"""
+    with job_db_lock:
+        row = job_db.execute("SELECT * FROM scan_index WHERE path = ?", (path,)).fetchone()
+    return dict(row) if row else None
+
+def get_scan_children(folder):
+    """索引に記録されたフォルダ直下のエントリ（パス -> 状態）"""
+    with job_db_lock:
+        rows = job_db.execute("SELECT * FROM scan_index WHERE parent = ?", (folder,)).fetchall()
+    return {row["path"]: dict(row) for row in rows}
+
+def save_scan_folder(folder, parent, stat, entries, removed, relist=False):
+    """フォルダの一覧取得結果を索引に保存（消えたサブフォルダは配下ごと削除）
     
-    if stop_requested:
-        return
+    entriesは(path, is_dir, size, mtime_ns, ctime_ns, inode)のリスト。
+    relistがTrueなら、フォルダに変化がなくても次回また一覧を取り直す。
+    """
+    # 更新直後のフォルダはmtimeの分解能内に変更が続く可能性があるため、次回も一覧を取り直す
+    mtime_ns = stat.st_mtime_ns if time.time_ns() - stat.st_mtime_ns > 2_000_000_000 else None
+    if relist:
+        mtime_ns = None
     
-    try:
-        logger.debug("入力フォルダのスキャンを開始します")
-        
-        input_folder = config.get("input_folder")
-        if not os.path.exists(input_folder):
-            log_and_print(f"入力フォルダが存在しません: {input_folder}", "warning")
-            ensure_directory(input_folder)
-            return
-        
-        # メディアファイルの拡張子
-        media_extensions = ('.mp3', '.mp4', '.wav', '.m4a', '.mov', '.avi', '.flac', '.ogg', '.aac')
-        
-        # 新しいファイルを検出
-        new_files = []
-        for file in os.listdir(input_folder):
-            file_path = os.path.join(input_folder, file)
-            
-            # ディレクトリはスキップ
-            if os.path.isdir(file_path):
-                continue
-            
-            # 対象拡張子のファイルのみ処理
-            if not file.lower().endswith(media_extensions):
-                continue
-            
-            # 既に処理中またはキュー済みのファイルはスキップ
-            if is_file_queued_or_processing(file_path):
-                continue
-            
-            new_files.append(file_path)
-        
-        if not new_files:
-            logger.debug("新しいファイルはありません")
-            return
-        
-        # キューに追加
-        for file_path in new_files:
-            file_name = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
-            
-            # ファイル情報のメタデータを作成
-            file_info = {
-                "path": file_path,
-                "name": file_name,
-                "size": file_size,
-                "queued_at": time.strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            processing_queue.append(file_info)
-            log_and_print(f"キュー追加: {file_name}", category="キュー", print_console=False)
-        
-        log_and_print(f"キュー状態: {len(processing_queue)}件待機中", category="キュー", print_console=False)
-        
-    except Exception as e:
-        log_and_print(f"キュースキャン中エラー: {e}", "error", category="キュー")
+    with job_db_lock:
+        job_db.execute("BEGIN")
+        try:
+            job_db.execute(
+                "INSERT OR REPLACE INTO scan_index (path, parent, is_dir, size, mtime_ns, inode) "
+                "VALUES (?, ?, 1, NULL, ?, ?)", (folder, parent, mtime_ns, stat.st_ino)
+            )
+            for path, is_dir in removed:
+                job_db.execute("DELETE FROM scan_index WHERE path = ?", (path,))
+                if is_dir:
+                    prefix = path + os.sep
+                    job_db.execute("DELETE FROM scan_index WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+            job_db.executemany(
+                "INSERT OR REPLACE INTO scan_index (path, parent, is_dir, size, mtime_ns, ctime_ns, inode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(entry[0], folder) + tuple(entry[1:]) for entry in entries]
+            )
+            job_db.execute("COMMIT")
+        except Exception:
+            job_db.execute("ROLLBACK")
+            raise
 
-def is_file_queued_or_processing(file_path):
-    """ファイルが既にキューにあるか確認"""
-    for item in processing_queue:
-        if item["path"] == file_path:
-            return True
-    
-    return False
+def save_scan_file(file_path, stat):
+    """キューへの登録を終えたファイルを索引に記録（以降、変化がなければ候補にしない）"""
+    with job_db_lock:
+        job_db.execute(
+            "INSERT OR REPLACE INTO scan_index (path, parent, is_dir, size, mtime_ns, ctime_ns, inode) "
+            "VALUES (?, ?, 0, ?, ?, ?, ?)",
+            (file_path, os.path.dirname(file_path), stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino)
+        )
 
-def wait_for_resources(max_wait_seconds=5):
+def scan_input_tree(input_folder):
+    """入力フォルダを再帰的にスキャンし、新しく現れた・変更されたメディアファイルを返す
     
-    """リソースが利用可能になるまで待機（タイムアウト付き）"""
-    global stop_requested
+    mtimeが前回と同じフォルダは一覧を取らず、索引にあるサブフォルダだけをたどる。
+    そのため、ファイルが多くても変化のあった分しかコストがかからない。
+    候補のファイルは索引に記録しない（呼び出し側が登録後にsave_scan_fileで記録する）。
+    途中で処理が止まっても、候補を含むフォルダは次回また一覧を取り直すため取りこぼさない。
+    """
+    candidates = []
+    folders = listed = 0
+    stack = [(input_folder, "")]
     
-    if stop_requested:
-        return False
+    while stack:
+        folder, parent = stack.pop()
+        try:
+            stat = os.stat(folder)
+        except FileNotFoundError:
+            continue
+        folders += 1
+        watch_subfolder(folder)
         
-    try:
-        import psutil
-    except ImportError:
-        return True  # psutilがない場合は常にリソース利用可能とする
+        known = get_scan_entry(folder)
+        if known and known["mtime_ns"] == stat.st_mtime_ns and known["inode"] == stat.st_ino:
+            # 変化なし：索引のサブフォルダだけ確認する
+            stack.extend((path, folder) for path, entry in get_scan_children(folder).items() if entry["is_dir"])
+            continue
         
-    max_cpu = config.get("max_cpu_percent", 95)
-    start_time = time.time()
-    
-    while time.time() - start_time < max_wait_seconds:
-        if stop_requested:
-            return False
-            
-        cpu_percent = psutil.cpu_percent(interval=1)  # 1秒間隔で測定
+        # 変化あり：一覧を取り直し、索引と異なるファイルだけを候補にする
+        listed += 1
+        previous = get_scan_children(folder)
+        entries = []
+        current = set()
+        found = len(candidates)
+        with os.scandir(folder) as iterator:
+            for entry in iterator:
+                if entry.name.startswith("."):
+                    continue  # 隠しフォルダ・作業用ファイルは対象外
+                
+                old = previous.get(entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    current.add(entry.path)
+                    stack.append((entry.path, folder))
+                    # 既知のサブフォルダの記録（mtime）は、そのフォルダ自身を調べたときに更新する
+                    if old is None or not old["is_dir"] or old["inode"] != entry.inode():
+                        entries.append((entry.path, 1, None, None, None, entry.inode()))
+                    continue
+                
+                # 対象拡張子のファイルのみ処理
+                if not entry.name.lower().endswith(MEDIA_EXTENSIONS) or not entry.is_file():
+                    continue
+                
+                try:
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # 一覧取得の直後に移動・削除された
+                current.add(entry.path)
+                # renameではサイズ・mtimeが変わらないため、一度消えて戻ったファイルはctimeで検出する
+                signature = (entry_stat.st_size, entry_stat.st_mtime_ns, entry_stat.st_ctime_ns, entry.inode())
+                if old is None or (old["size"], old["mtime_ns"], old["ctime_ns"], old["inode"]) != signature:
+                    candidates.append(entry.path)
         
-        if cpu_percent <= max_cpu:
-            return True  # リソース利用可能
-            
-        wait_time = min(2, max_wait_seconds - (time.time() - start_time))
-        if wait_time <= 0:
-            break
-            
-        log_and_print(f"CPU使用率が高いため待機中: {cpu_percent}% > {max_cpu}% (あと{wait_time:.0f}秒)")
-        time.sleep(min(1, wait_time))  # 最大1秒待機
+        removed = [(path, old["is_dir"]) for path, old in previous.items() if path not in current]
+        save_scan_folder(folder, parent, stat, entries, removed, relist=len(candidates) > found)
     
-    return False  # タイムアウト
+    logger.debug(f"スキャン: フォルダ{folders}件（一覧取得{listed}件）, 新規・変更{len(candidates)}件")
+    return candidates
 
-def process_next_file():
-    """キューの次のファイルを処理"""
-    global processing_queue, stop_requested
-    
-    if stop_requested or not is_running:
-        return False
-    
+def get_relative_folder(file_path):
+    """入力フォルダからの相対フォルダ（入力フォルダ直下・入力フォルダ外のファイルなら空文字）"""
     try:
-        if not processing_queue:
-            return False  # 処理すべきファイルなし
-        
-        # リソース使用状況を確認
-        if not wait_for_resources():
-            return False  # リソース不足またはタイムアウト
-        
-        # 次のファイルを取得
-        file_info = processing_queue.pop(0)
-        file_path = file_info["path"]
-        
-        # 処理開始
-        result = process_file(file_path)
-        return result is not None
-    
-    except Exception as e:
-        log_and_print(f"ファイル処理中にエラーが発生しました: {e}", "error")
-        return False
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(file_path)),
+                                   os.path.abspath(config.get("input_folder")))
+    except ValueError:
+        return ""  # Windowsで別ドライブの場合
+    if relative == "." or relative.startswith(".."):
+        return ""
+    return relative
 
-def process_file(file_path):
-    """ファイルを処理する"""
-    global stop_requested
+#=======================================================================
+# 文字起こしキャッシュ
+#=======================================================================
+
+def hash_file(file_path, chunk_size=1024 * 1024):
+    """ファイル内容のハッシュを計算（BLAKE2b、1MBずつ読み込み）"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_cache_key(file_path, model_size=None):
+    """キャッシュキーを作成（内容が同じでも設定が違えば別の結果として扱う）"""
+    params = {
+        "whisper_model": model_size or config.get("whisper_model", "large"),
+        "compute_type": config.get("compute_type", "int8"),
+        "language": config.get("language", "ja"),
+        "decoding": get_decoding_options(),
+        "two_pass": get_two_pass_settings() if is_two_pass() else None
+    }
+    params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    params_hash = hashlib.blake2b(params_json.encode('utf-8'), digest_size=8).hexdigest()
+    return f"{hash_file(file_path)}-{params_hash}"
+
+def lookup_cached_transcript(cache_key):
+    """キャッシュから文字起こし結果を取得（なければNone）"""
+    with job_db_lock:
+        row = job_db.execute(
+            "SELECT transcript FROM transcript_cache WHERE key = ?", (cache_key,)
+        ).fetchone()
+        if row is not None:
+            job_db.execute(
+                "UPDATE transcript_cache SET last_used = ? WHERE key = ?", (time.time(), cache_key)
+            )
     
-    if stop_requested:
-        return None
+    with stats_lock:
+        cache_stats["hit" if row is not None else "miss"] += 1
     
-    start_time = time.time()
-    try:
-        # ファイルが存在するか確認
-        if not os.path.exists(file_path):
-            log_and_print(f"ファイルが存在しません: {file_path}", "warning", category="ファイル")
-            return None
-        
-        file_name = os.path.basename(file_path)
-        log_and_print(f"処理開始: {file_name}", category="ファイル", print_console=False)
-        
-        # 文字起こし処理を実行
-        transcription = transcribe_audio(file_path)
-        
-        if stop_requested:
-            log_and_print(f"処理中断: {file_name}", "warning", category="ファイル")
-            return None
+    return row["transcript"] if row is not None else None
+
+def store_cached_transcript(cache_key, transcription):
+    """文字起こし結果をキャッシュに保存し、上限を超えた分を古い順に削除"""
+    size = len(transcription.encode('utf-8'))
+    max_bytes = config.get("transcript_cache_max_mb", 200) * 1024 * 1024
+    now = time.time()
+    
+    with job_db_lock:
+        job_db.execute(
+            "INSERT OR REPLACE INTO transcript_cache (key, transcript, size, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (cache_key, transcription, size, now, now)
+        )
         
-        if transcription:
-            # 出力ファイルパスを生成
-            output_folder = config.get("output_folder")
-            output_path = Path(output_folder)
-            output_path.mkdir(exist_ok=True)
-            
-            output_file = output_path / f"{Path(file_name).stem}.txt"
-            
-            # 結果を保存
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(transcription)
-            
-            # 処理時間を計算
-            processing_time = time.time() - start_time
-            log_and_print(f"処理完了: {file_name} → {output_file} (処理時間: {processing_time:.2f}秒)", category="ファイル")
-            
-            # アーカイブフォルダに移動
-            archive_folder = config.get("archive_folder", "archive")
-            ensure_directory(archive_folder)
-            
-            archive_path = os.path.join(archive_folder, file_name)
-            archive_path = safe_move_file(file_path, archive_path)
-            log_and_print(f"アーカイブ: {file_name}", category="ファイル", print_console=False)
-            
-            return str(output_file)
-        else:
-            log_and_print(f"処理失敗: {file_name}", "error", category="ファイル")
-            return None
+        # LRU: 最後に使われたのが古いものから削除
+        total = job_db.execute("SELECT COALESCE(SUM(size), 0) FROM transcript_cache").fetchone()[0]
+        evicted = 0
+        while total > max_bytes:
+            row = job_db.execute(
+                "SELECT key, size FROM transcript_cache ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            job_db.execute("DELETE FROM transcript_cache WHERE key = ?", (row["key"],))
+            total -= row["size"]
+            evicted += 1
     
-    except Exception as e:
-        log_and_print(f"エラー発生: {file_path} - {e}", "error", category="ファイル")
-        return None
+    if evicted:
+        log_and_print(f"キャッシュ削除: {evicted}件（上限{config.get('transcript_cache_max_mb', 200)}MB）",
+                      category="キャッシュ", print_console=False)
+
+def log_cache_stats(file_name, hit):
+    """キャッシュのヒット・ミスと累計をログに記録"""
+    result = "ヒット" if hit else "ミス"
+    log_and_print(f"{result}: {file_name} (累計 ヒット{cache_stats['hit']}件 / ミス{cache_stats['miss']}件)",
+                  category="キャッシュ", print_console=False)
 
 #=======================================================================
-# メイン処理ループとスレッド管理
+# モデルの自動選択（ターンアラウンド目標）
 #=======================================================================
 
-def processing_loop():
-    """文字起こし処理のメインループ（スレッドで実行）"""
-    global is_running, stop_requested
-    
+# 実測がないモデルの実時間係数の初期値（CPU・int8でのおおよその値）
+DEFAULT_MODEL_RTF = {
+    "tiny": 0.03,
+    "base": 0.05,
+    "small": 0.1,
+    "medium": 0.25,
+    "large": 0.5
+}
+
+def probe_media_duration(file_path):
+    """音声・動画の長さ（秒）をヘッダから取得（取得できなければNone）"""
     try:
-        log_and_print("文字起こし処理を開始しました", category="システム")
-        
-        scan_interval = config.get("scan_interval_minutes", 30) * 60  # 秒に変換
-        last_scan_time = 0
-        
-        # 初回スキャン
-        scan_and_queue_files()
-        
-        # メインループ
-        while is_running and not stop_requested:
-            # ファイル処理
-            while process_next_file():
-                if stop_requested:
-                    break
-                time.sleep(0.1)  # 短い待機
-            
-            # 定期的にフォルダをスキャン
-            current_time = time.time()
-            if current_time - last_scan_time >= scan_interval:
-                scan_and_queue_files()
-                last_scan_time = current_time
-            
-            # 短い待機（停止チェックの頻度も兼ねる）
-            time.sleep(1)
-        
+        import av
+        with av.open(file_path) as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+            for stream in container.streams.audio:
+                if stream.duration is not None and stream.time_base is not None:
+                    return float(stream.duration * stream.time_base)
     except Exception as e:
-        log_and_print(f"処理ループでエラーが発生しました: {e}", "error", category="システム")
-    finally:
-        is_running = False
-        log_and_print("文字起こし処理を終了しました", category="システム")
+        logger.debug(f"長さを取得できません: {file_path} - {e}")
+    return None
 
-def start_processing():
-    """文字起こし処理を開始"""
-    global is_running, stop_requested, processing_thread
+def get_model_rtf(model_size):
+    """モデルの実時間係数（直近20件の実測平均、実測がなければ初期値）"""
+    with job_db_lock:
+        row = job_db.execute(
+            "SELECT AVG(rtf) FROM (SELECT rtf FROM jobs WHERE model = ? AND rtf IS NOT NULL "
+            "ORDER BY id DESC LIMIT 20)", (model_size,)
+        ).fetchone()
     
-    if is_running:
-        return False  # 既に実行中
+    if row[0] is not None:
+        return row[0]
+    base_size = model_size.split(".")[0].split("-")[0]
+    return DEFAULT_MODEL_RTF.get(base_size, DEFAULT_MODEL_RTF["large"])
+
+def select_model_for_backlog(job):
+    """待機中の音声の総量から、目標時間内に処理しきれる最も高精度なモデルを選ぶ
     
-    # フラグを設定
-    is_running = True
-    stop_requested = False
+    turnaround_target_hoursが0なら常にwhisper_modelを使う。
+    """
+    default_model = config.get("whisper_model", "large")
+    target_hours = config.get("turnaround_target_hours", 0)
+    if not target_hours:
+        return default_model
     
-    # 処理スレッドを開始
-    processing_thread = threading.Thread(target=processing_loop)
-    processing_thread.daemon = True  # メインスレッド終了時に自動終了
-    processing_thread.start()
+    # 今回のジョブ + 待機中のジョブをワーカー数で分担したときの所要時間で判定
+    remaining = get_queued_audio_seconds() + (job.get("duration") or 0)
+    workers = get_worker_count()
+    candidates = config.get("adaptive_models", ["large", "medium", "small"])
     
-    return True
-
+    for model_size in candidates:
+        estimated_hours = remaining * get_model_rtf(model_size) / workers / 3600
+        if estimated_hours <= target_hours:
+            break
+    else:
+        model_size = candidates[-1]  # どのモデルでも間に合わない場合は最速のモデル
+    
+    if model_size != default_model:
+        log_and_print(f"モデル自動選択: {job['name']} → {model_size} "
+                      f"(残り音声{remaining / 3600:.1f}時間, 目標{target_hours}時間)",
+                      category="モデル", print_console=False)
+    return model_size
 
 #=======================================================================
-# CLI インターフェース
+# CPUコアの割り当て（スレッド数の自動調整）
 #=======================================================================
 
-def clear_screen():
-    """画面をクリアしてタイトルを設定"""
-    if IS_WINDOWS:
+def get_cgroup_cpu_limit():
+    """cgroupのCPUクォータ（コア数換算、制限なしならNone）"""
+    try:
+        # cgroup v2
+        with open("/sys/fs/cgroup/cpu.max", 'r') as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+        return None
+    except (OSError, ValueError):
+        pass
+    
+    try:
+        # cgroup v1
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", 'r') as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", 'r') as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return max(1, int(quota / period))
+    except (OSError, ValueError):
+        pass
+    
+    return None
+
+def get_allowed_cpus():
+    """このプロセスが使えるCPU番号の一覧"""
+    if hasattr(os, "sched_getaffinity"):
+        # 0だと呼び出したスレッドの設定になり、固定済みのワーカーからは割り当て分しか見えないため、
+        # 固定しないメインスレッド（スレッドID = プロセスID）の設定を使う
+        return sorted(os.sched_getaffinity(os.getpid()))
+    return list(range(os.cpu_count() or 1))
+
+def get_usable_cores():
+    """推論に使うコア数（物理コア数・割り当てCPU・cgroupクォータの最小値）
+    
+    ハイパースレッドの論理コアまで使うと行列演算が遅くなるため、物理コア数を上限とする。
+    """
+    allowed = len(get_allowed_cpus())
+    physical = psutil.cpu_count(logical=False) or allowed
+    logical = psutil.cpu_count(logical=True) or allowed
+    
+    # 割り当てCPUが論理コアの一部だけなら、物理コアも同じ割合で使えるとみなす
+    usable = min(allowed, max(1, physical * allowed // logical))
+    
+    quota = get_cgroup_cpu_limit()
+    if quota is not None:
+        usable = min(usable, quota)
+    return max(1, usable)
+
+def get_tuning_key(model_size, compute_type):
+    """自動調整結果を保存するキー（ホスト・コア数・モデルが変われば計測し直す）"""
+    return f"{platform.node()}|{get_usable_cores()}|{model_size}|{compute_type}"
+
+def load_thread_tuning():
+    """保存済みの自動調整結果を読み込む（対象外・未計測ならNone）"""
+    if config.get("thread_tuning", "off") != "auto":
+        return None
+    
+    key = get_tuning_key(config.get("whisper_model", "large"), config.get("compute_type", "int8"))
+    try:
+        with open(config.get("thread_tuning_file"), 'r', encoding='utf-8') as f:
+            return json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+def get_tuning_audio(seconds=30):
+    """計測用の音声（入力フォルダの最初のファイルの先頭、なければ合成音声）"""
+    input_folder = config.get("input_folder")
+    try:
+        for entry in sorted(os.listdir(input_folder)):
+            if entry.lower().endswith(MEDIA_EXTENSIONS):
+                audio = load_audio(os.path.join(input_folder, entry))
+                if len(audio) >= SAMPLE_RATE * 5:
+                    return audio[:SAMPLE_RATE * seconds]
+    except Exception as e:
+        logger.debug(f"計測用の音声を読み込めません: {e}")
+    
+    # 発話を模した断続的なトーン + ノイズ
+    import numpy as np
+    rng = np.random.default_rng(0)
+    t = np.arange(SAMPLE_RATE * seconds) / SAMPLE_RATE
+    voiced = (t.astype(int) % 3 != 2)
+    audio = 0.3 * np.sin(2 * np.pi * 180 * t) * voiced + 0.01 * rng.standard_normal(len(t))
+    return audio.astype(np.float32)
+
+def measure_thread_split(model_size, compute_type, workers, cpu_threads, audio):
+    """ワーカー数×スレッド数の組み合わせで同時に推論し、スループット（音声秒/秒）を返す"""
+    model = create_whisper_model(model_size, compute_type, cpu_threads, workers)
+    
+    def run():
+        segments, _ = model.transcribe(audio, language=config.get("language", "ja"),
+                                       beam_size=5, best_of=5, vad_filter=False)
+        for _ in segments:
+            pass
+    
+    run()  # ウォームアップ
+    
+    threads = [threading.Thread(target=run) for _ in range(workers)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    
+    return workers * len(audio) / SAMPLE_RATE / elapsed
+
+def run_thread_tuning():
+    """ワーカー数・スレッド数の組み合わせを計測し、最もスループットが高いものを保存"""
+    model_size = config.get("whisper_model", "large")
+    compute_type = config.get("compute_type", "int8")
+    usable = get_usable_cores()
+    audio = get_tuning_audio()
+    
+    candidates = [workers for workers in (1, 2, 4, 8) if workers <= usable]
+    log_and_print(f"スレッド数の自動調整を開始します（使用可能コア: {usable}, 候補: {len(candidates)}通り）",
+                  category="システム")
+    
+    results = []
+    for workers in candidates:
+        if stop_requested:
+            return None
+        cpu_threads = max(1, usable // workers)
+        throughput = measure_thread_split(model_size, compute_type, workers, cpu_threads, audio)
+        results.append({"workers": workers, "cpu_threads": cpu_threads, "throughput": round(throughput, 3)})
+        log_and_print(f"計測: ワーカー{workers} × スレッド{cpu_threads} → 音声{throughput:.2f}秒/秒",
+                      category="システム", print_console=False)
+    
+    best = max(results, key=lambda result: result["throughput"])
+    best = dict(best, tuned_at=time.strftime("%Y-%m-%d %H:%M:%S"), results=results)
+    
+    # 他のモデル・ホストの結果は残したまま保存
+    tuning_file = config.get("thread_tuning_file")
+    try:
+        with open(tuning_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        saved = {}
+    saved[get_tuning_key(model_size, compute_type)] = best
+    with open(tuning_file, 'w', encoding='utf-8') as f:
+        json.dump(saved, f, indent=2, ensure_ascii=False)
+    
+    log_and_print(f"スレッド数の自動調整が完了しました: ワーカー{best['workers']} × スレッド{best['cpu_threads']}",
+                  category="システム")
+    return best
+
+def apply_thread_tuning():
+    """自動調整結果を読み込み、未計測なら計測する（thread_tuningがautoの場合のみ）"""
+    global thread_tuning
+    
+    thread_tuning = None
+    if config.get("thread_tuning", "off") != "auto":
+        return
+    
+    tuning = load_thread_tuning()
+    if tuning is None:
+        try:
+            tuning = run_thread_tuning()
+        except Exception as e:
+            log_and_print(f"スレッド数の自動調整に失敗しました: {e}（設定値で動作します）", "warning", category="システム")
+            return
+    
+    thread_tuning = tuning
+    if tuning is not None:
+        log_and_print(f"自動調整済みの設定を使用: ワーカー{tuning['workers']} × スレッド{tuning['cpu_threads']}",
+                      category="システム", print_console=False)
+
+def pin_current_worker(worker_id):
+    """ワーカースレッドを他のワーカーと重ならないコアに固定（Linuxのみ）
+    
+    デコード・VAD・特徴量抽出はワーカースレッド上で動くため、ワーカー間で取り合わなくなる。
+    CTranslate2の推論スレッドはモデル側で生成されるので、cpu_threadsで本数を制限している。
+    """
+    if not config.get("pin_workers", False) or not hasattr(os, "sched_setaffinity"):
+        return
+    
+    cpus = get_allowed_cpus()
+    per_worker = max(1, len(cpus) // get_worker_count())
+    start = ((worker_id - 1) * per_worker) % len(cpus)
+    assigned = set(cpus[start:start + per_worker])
+    try:
+        os.sched_setaffinity(0, assigned)  # Linuxでは呼び出したスレッドのみに適用される
+        logger.debug(f"ワーカー{worker_id}をCPU {sorted(assigned)} に固定しました")
+    except OSError as e:
+        log_and_print(f"ワーカー{worker_id}のCPU固定に失敗しました: {e}", "warning", category="システム")
+
+@contextlib.contextmanager
+def unpinned_thread():
+    """呼び出したスレッドのCPU固定を一時的に外す
+    
+    CTranslate2のレプリカ・推論スレッドは生成元スレッドのCPU割り当てを引き継ぐため、
+    固定済みのワーカーがモデルをロードすると、全ワーカーの推論がそのワーカーのコアに偏ってしまう。
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        yield
+        return
+    
+    pinned = os.sched_getaffinity(0)
+    allowed = set(get_allowed_cpus())
+    if pinned == allowed:
+        yield
+        return
+    
+    os.sched_setaffinity(0, allowed)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, pinned)
+
+#=======================================================================
+# モデルストア（取り込み済みの変換済みモデル）
+#=======================================================================
+# models/<モデル>/<compute_type>/<バージョン>/ に CTranslate2 形式のモデルと manifest.json（各ファイルの
+# サイズとBLAKE2bハッシュ）を置き、同じフォルダの current ファイルに使用中のバージョン名を書く。
+# 取り込みは一時フォルダに書いてからrenameするため、途中で失敗しても使用中のモデルは壊れない。
+
+MODEL_STORE_CURRENT = "current"
+MODEL_MANIFEST = "manifest.json"
+
+def get_model_store_folder(model_size, compute_type):
+    """モデル・compute_typeごとのモデルストアのフォルダ"""
+    return os.path.join(config.get("model_store"), model_size, compute_type)
+
+def read_model_manifest(model_size, compute_type):
+    """使用中のバージョンのフォルダとマニフェストを取得（取り込まれていなければ(None, None)）"""
+    folder = get_model_store_folder(model_size, compute_type)
+    try:
+        with open(os.path.join(folder, MODEL_STORE_CURRENT), 'r', encoding='utf-8') as f:
+            model_path = os.path.join(folder, f.read().strip())
+        with open(os.path.join(model_path, MODEL_MANIFEST), 'r', encoding='utf-8') as f:
+            return model_path, json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+def resolve_model_path(model_size, compute_type):
+    """モデルストアにあればそのフォルダ、なければモデル名（従来通りHugging Faceから取得）を返す
+    
+    起動を速くするため、ここではファイルの有無とサイズのみ確認する（ハッシュは--verify-modelsで検証）。
+    """
+    if not config.get("model_store"):
+        return model_size
+    
+    model_path, manifest = read_model_manifest(model_size, compute_type)
+    if manifest is None:
+        return model_size
+    
+    for name, info in manifest["files"].items():
+        file_path = os.path.join(model_path, name)
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) != info["size"]:
+            log_and_print(f"モデルストアのファイルが不完全です: {file_path}（Hugging Faceから読み込みます）",
+                          "warning", category="モデル")
+            return model_size
+    
+    logger.debug(f"モデルストアから読み込み: {model_path}")
+    return model_path
+
+def import_model(model_size, compute_type, source=None):
+    """モデルを変換・取り込みしてモデルストアに新しいバージョンとして保存し、保存先を返す
+    
+    source: CTranslate2形式のフォルダ（そのままコピー）、Transformers形式のフォルダまたは
+    Hugging FaceのID（compute_typeに量子化して変換）。省略時はfaster-whisperの変換済みモデルを
+    ダウンロードする（重みはfloat16のまま保存され、読み込み時にcompute_typeへ変換される）。
+    """
+    if not config.get("model_store"):
+        raise ValueError("model_storeが空のため、モデルストアは無効です（取り込み先のフォルダを設定してください）")
+    
+    store_folder = get_model_store_folder(model_size, compute_type)
+    version = time.strftime("%Y%m%d-%H%M%S")
+    temp_path = os.path.join(store_folder, f".{version}.tmp")
+    ensure_directory(temp_path)
+    
+    try:
+        if source and os.path.isfile(os.path.join(source, "model.bin")):
+            log_and_print(f"変換済みモデルをコピーしています: {source}", category="モデル")
+            for name in os.listdir(source):
+                if os.path.isfile(os.path.join(source, name)):
+                    shutil.copy2(os.path.join(source, name), os.path.join(temp_path, name))
+            quantization = None  # 元のモデルのまま
+        elif source:
+            from ctranslate2.converters import TransformersConverter
+            quantization = compute_type if compute_type not in ("auto", "default") else None
+            log_and_print(f"モデルを変換しています: {source} (量子化: {quantization or 'なし'})", category="モデル")
+            converter = TransformersConverter(source, copy_files=["tokenizer.json", "preprocessor_config.json"])
+            converter.convert(temp_path, quantization=quantization, force=True)
+        else:
+            from faster_whisper.utils import download_model
+            log_and_print(f"モデルをダウンロードしています: {model_size}", category="モデル")
+            download_model(model_size, output_dir=temp_path)
+            quantization = None
+        
+        # 各ファイルのサイズとハッシュを記録
+        files = {}
+        for name in sorted(os.listdir(temp_path)):
+            file_path = os.path.join(temp_path, name)
+            if os.path.isfile(file_path):
+                files[name] = {"size": os.path.getsize(file_path), "blake2b": hash_file(file_path)}
+        if "model.bin" not in files:
+            raise ValueError("model.binが見つかりません（CTranslate2形式のモデルではありません）")
+        
+        manifest = {
+            "model": model_size,
+            "compute_type": compute_type,
+            "quantization": quantization,
+            "source": source or f"faster-whisper:{model_size}",
+            "version": version,
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "files": files
+        }
+        with open(os.path.join(temp_path, MODEL_MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        
+        model_path = os.path.join(store_folder, version)
+        os.rename(temp_path, model_path)
+    except Exception:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    
+    # 使用中のバージョンを切り替え（書き込み途中の状態を読まれないよう置き換えで更新）
+    current_path = os.path.join(store_folder, MODEL_STORE_CURRENT)
+    with open(current_path + ".tmp", 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(current_path + ".tmp", current_path)
+    
+    prune_model_versions(store_folder, version)
+    log_and_print(f"モデルを取り込みました: {model_path}", category="モデル")
+    return model_path
+
+def prune_model_versions(store_folder, current_version):
+    """古いバージョンを削除（model_store_keep_versions個まで残し、使用中のバージョンは消さない）"""
+    keep = max(1, config.get("model_store_keep_versions", 2))
+    versions = sorted(name for name in os.listdir(store_folder)
+                      if not name.startswith(".") and os.path.isdir(os.path.join(store_folder, name)))
+    for version in versions[:-keep]:
+        if version != current_version:
+            shutil.rmtree(os.path.join(store_folder, version), ignore_errors=True)
+            log_and_print(f"古いモデルを削除しました: {version}", category="モデル", print_console=False)
+
+def verify_model_store():
+    """モデルストアの使用中のモデルをハッシュで検証し、すべて正常ならTrue"""
+    store = config.get("model_store")
+    if not store or not os.path.isdir(store):
+        print(f"モデルストアがありません: {store}")
+        return False
+    
+    all_ok = True
+    for model_size in sorted(os.listdir(store)):
+        if not os.path.isdir(os.path.join(store, model_size)):
+            continue
+        for compute_type in sorted(os.listdir(os.path.join(store, model_size))):
+            model_path, manifest = read_model_manifest(model_size, compute_type)
+            if manifest is None:
+                continue
+            
+            broken = []
+            for name, info in manifest["files"].items():
+                file_path = os.path.join(model_path, name)
+                if not os.path.isfile(file_path) or hash_file(file_path) != info["blake2b"]:
+                    broken.append(name)
+            
+            all_ok = all_ok and not broken
+            status = "OK" if not broken else f"NG（{', '.join(broken)}）"
+            print(f"{model_size} / {compute_type} / {manifest['version']}: {status}")
+    
+    return all_ok
+
+#=======================================================================
+# 無音の事前判定
+#=======================================================================
+
+def detect_speech_range(audio):
+    """Whisperを使わずに発話のある範囲を調べる（無音ならNone、それ以外は(開始秒, 終了秒)）
+    
+    まず音量（30msごとのRMS）で明らかな無音を判定し、そうでなければVADで発話区間を求める。
+    先頭・末尾の無音がsilence_trim_min_seconds未満なら切り詰めない（VADの誤差で言葉の頭を削らないため）。
+    """
+    import numpy as np
+    
+    samples = np.asarray(audio, dtype=np.float32)
+    duration = len(samples) / SAMPLE_RATE
+    
+    # 音量が閾値に届かないファイルはVADも不要
+    frame = int(0.03 * SAMPLE_RATE)
+    frames = len(samples) // frame
+    if frames == 0:
+        return None
+    rms = np.sqrt(np.mean(np.square(samples[:frames * frame].reshape(frames, frame)), axis=1))
+    if rms.max() < 10 ** (config.get("silence_threshold_db", -50) / 20):
+        return None
+    
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    speech = get_speech_timestamps(samples, VadOptions())
+    if not speech:
+        return None
+    
+    margin = config.get("silence_margin_seconds", 1.0)
+    min_trim = config.get("silence_trim_min_seconds", 30)
+    start = max(0.0, speech[0]["start"] / SAMPLE_RATE - margin)
+    end = min(duration, speech[-1]["end"] / SAMPLE_RATE + margin)
+    if start < min_trim:
+        start = 0.0
+    if duration - end < min_trim:
+        end = duration
+    return start, end
+
+def log_silence_stats(file_name, duration, speech_range):
+    """無音の判定・切り詰め結果をログとメトリクスに記録"""
+    if speech_range is None:
+        observe_silence(duration, True)
+        log_and_print(f"無音ファイル: {file_name} ({duration:.0f}秒) - 文字起こしをスキップしました",
+                      category="処理", print_console=False)
+        return
+    
+    start, end = speech_range
+    skipped = start + (duration - end)
+    if skipped <= 0:
+        return
+    observe_silence(skipped, False)
+    log_and_print(f"無音を除外: {file_name} - 先頭{start:.0f}秒・末尾{duration - end:.0f}秒 "
+                  f"(全体{duration:.0f}秒のうち{skipped / duration:.0%}を削減)",
+                  category="処理", print_console=False)
+
+#=======================================================================
+# 文字起こし処理
+#=======================================================================
+
+def get_decoding_options():
+    """Whisperのデコード設定（キャッシュキーにも使用）
+    
+    two_passモードでは1回目をグリーディ（ビーム幅1）で推論し、
+    確信度の低いセグメントだけをビームサーチで推論し直す（refine_segment_text）。
+    """
+    if is_two_pass():
+        options = {
+            "beam_size": 1,
+            "best_of": 1,
+            "vad_filter": True
+        }
+    else:
+        options = {
+            "beam_size": 5,
+            "best_of": 5,
+            "vad_filter": True
+        }
+    if config.get("inference_engine", "sequential") == "batched":
+        options["batch_size"] = max(1, int(config.get("batch_size", 8)))
+    return options
+
+def is_two_pass():
+    """2段階デコード（グリーディ + 必要な区間だけビームサーチ）が有効か"""
+    return config.get("decoding_mode", "beam") == "two_pass"
+
+def get_two_pass_settings():
+    """2段階デコードの再推論の判定基準（キャッシュキーにも使用）"""
+    return {
+        "logprob_threshold": config.get("two_pass_logprob_threshold", -0.8),
+        "compression_ratio_threshold": config.get("two_pass_compression_ratio_threshold", 2.2),
+        "beam_size": config.get("two_pass_beam_size", 5)
+    }
+
+def refine_segment_text(model, audio, segment):
+    """2段階デコード時、確信度の低いセグメントをビームサーチで推論し直す
+    
+    平均対数確率が低い、または圧縮率が高い（同じ語の繰り返しなど）セグメントが対象。
+    戻り値は(テキスト, 推論し直したか)。audioはsegmentの時刻の基準となる音声配列。
+    """
+    text = segment.text.strip()
+    if not is_two_pass():
+        return text, False
+    
+    settings = get_two_pass_settings()
+    if (segment.avg_logprob >= settings["logprob_threshold"] and
+            segment.compression_ratio <= settings["compression_ratio_threshold"]):
+        return text, False
+    
+    segment_audio = audio[int(segment.start * SAMPLE_RATE):int(segment.end * SAMPLE_RATE)]
+    if len(segment_audio) == 0:
+        return text, False
+    
+    with trace_stage("redecode"):
+        beam_segments, _ = model.transcribe(
+            segment_audio,
+            language=config.get("language", "ja"),
+            beam_size=settings["beam_size"],
+            best_of=settings["beam_size"],
+            vad_filter=False,
+            without_timestamps=True,
+            condition_on_previous_text=False
+        )
+        refined = "".join(beam_segment.text for beam_segment in beam_segments).strip()
+    
+    return (refined or text), True
+
+def log_two_pass_stats(file_name, redecoded, total):
+    """2段階デコードで推論し直したセグメントの割合を記録"""
+    if not is_two_pass() or not total:
+        return
+    
+    trace_set("redecoded_segments", redecoded)
+    log_and_print(f"2段階デコード: {file_name} - {redecoded}/{total}セグメントをビームサーチで再推論 "
+                  f"({redecoded / total * 100:.1f}%)", category="処理", print_console=False)
+
+def get_transcriber(model):
+    """設定に応じた推論エンジンを返す
+    
+    sequential: WhisperModel.transcribe（従来通り1区間ずつ推論）
+    batched: BatchedInferencePipeline（VADで区切った複数区間をまとめて推論）
+    """
+    global batched_engine_unavailable
+    
+    if config.get("inference_engine", "sequential") == "batched":
+        try:
+            from faster_whisper import BatchedInferencePipeline
+        except ImportError:
+            # faster-whisper 1.1より前にはない。ジョブを失敗させずに従来の推論で続ける
+            if not batched_engine_unavailable:
+                batched_engine_unavailable = True
+                log_and_print("インストールされているfaster-whisperはbatchedに対応していません"
+                              "（1.1.0以上が必要）。sequentialで推論します", "warning", category="モデル")
+            return model
+        return BatchedInferencePipeline(model=model)
+    return model
+
+
+def get_worker_count():
+    """並列ワーカー数を取得（自動調整済みならその値、最低1）"""
+    if thread_tuning is not None:
+        return thread_tuning["workers"]
+    try:
+        return max(1, int(config.get("max_workers", 1)))
+    except (TypeError, ValueError):
+        return 1
+
+def get_chunk_parallelism():
+    """分割文字起こしで同時に推論するチャンク数（最低でもワーカー数）
+    
+    chunk_parallelismが0なら、1チャンクあたり2スレッド（自動調整済みならそのスレッド数）に
+    なるよう使えるコア数から決める。max_workersが1でも、長い録音はコア数に応じて並列に処理される。
+    """
+    try:
+        parallelism = int(config.get("chunk_parallelism", 0))
+    except (TypeError, ValueError):
+        parallelism = 0
+    if parallelism <= 0:
+        threads = thread_tuning["cpu_threads"] if thread_tuning is not None else 2
+        parallelism = get_usable_cores() // threads
+    return max(get_worker_count(), parallelism)
+
+def get_cpu_threads_per_worker():
+    """ワーカー1つあたりのCPUスレッド数（使えるコア数をワーカー数で等分）"""
+    if thread_tuning is not None:
+        return thread_tuning["cpu_threads"]
+    return max(1, get_usable_cores() // get_worker_count())
+
+def get_model_layout(chunked=False):
+    """モデルのレプリカ数（同時に推論できる数）とレプリカ1つあたりのCPUスレッド数
+    
+    通常のジョブはワーカー数分のレプリカ、分割文字起こしはチャンクの並列数分のレプリカで
+    使えるコアを等分する。レプリカのスレッド数はロード後に変えられないため、分割用のモデルは
+    別にロードし、短い録音がスレッド数の少ない分割用のレプリカで推論されないようにする。
+    """
+    if chunked:
+        parallelism = get_chunk_parallelism()
+        return parallelism, max(1, get_usable_cores() // parallelism)
+    return get_worker_count(), get_cpu_threads_per_worker()
+
+def is_model_resident(model_size, compute_type):
+    """モデルがロード済み・ロード中か（レプリカ構成は問わない）"""
+    with model_lock:
+        return any(key[:2] == (model_size, compute_type) for key in list(model_pool) + list(model_loading))
+
+def estimate_model_memory_mb(model_size, compute_type):
+    """モデルの必要メモリを見積もる（MB）"""
+    base_size = model_size.split(".")[0].split("-")[0]  # large-v3, medium.en なども同じ扱い
+    memory = MODEL_MEMORY_MB.get(base_size, MODEL_MEMORY_MB["large"])
+    if compute_type.startswith("int8"):
+        memory //= 2
+    return memory
+
+def create_whisper_model(model_size, compute_type, cpu_threads, num_workers):
+    """WhisperModelを生成（ベンチマークではスタブに差し替える）"""
+    from faster_whisper import WhisperModel
+    
+    # モデルストアに取り込み済みならそのフォルダから直接読み込む（ネットワーク・HFキャッシュ不要）
+    model_path = resolve_model_path(model_size, compute_type)
+    
+    # num_workersでワーカー数分のモデルレプリカを持ち、各スレッドから並列に呼び出せる
+    return WhisperModel(model_path, compute_type=compute_type,
+                        cpu_threads=cpu_threads, num_workers=num_workers)
+
+def get_whisper_model(model_size=None, compute_type=None, chunked=False):
+    """Whisperモデルを取得（プールになければロードし、メモリ上限を超えたら古いモデルを解放）
+    
+    chunkedがTrueなら分割文字起こし用のレプリカ構成のモデルを返す（通常と同じ構成なら同じモデル）。
+    """
+    global stop_requested
+    
+    # モデルサイズを設定
+    model_size = model_size or config.get("whisper_model", "large")
+    compute_type = compute_type or config.get("compute_type", "int8")  # config.jsonから読み込み
+    num_workers, cpu_threads = get_model_layout(chunked)
+    key = (model_size, compute_type, num_workers, cpu_threads)
+    
+    # ロード済みならそのまま使う。同じモデルを別のスレッドがロード中なら完了を待つ
+    # （ロード中もロックは保持しないため、ロード済みのモデルを使うワーカーは待たされない）
+    while True:
+        with model_lock:
+            if key in model_pool:
+                model_pool.move_to_end(key)
+                return model_pool[key]
+            
+            # モデルロード前に再度停止要求をチェック
+            if stop_requested:
+                log_and_print("モデルロードをキャンセル（停止要求）", category="モデル", print_console=False)
+                return None
+            
+            loading = model_loading.get(key)
+            if loading is None:
+                loading = model_loading[key] = threading.Event()
+                break
+        loading.wait()
+    
+    try:
+        with model_lock:
+            # 上限を超える分だけ、最も長く使われていないモデルを解放（ロード中のモデルも数える）
+            max_mb = config.get("model_pool_max_mb", 12000)
+            required = sum(estimate_model_memory_mb(*k[:2]) for k in model_loading)
+            while model_pool and sum(estimate_model_memory_mb(*k[:2]) for k in model_pool) + required > max_mb:
+                evicted, _ = model_pool.popitem(last=False)
+                log_and_print(f"モデル解放: Whisper {evicted[0]} ({evicted[1]})", category="モデル", print_console=False)
+        
+        log_and_print(f"モデルロード: Whisper {model_size} (compute_type: {compute_type}, "
+                      f"レプリカ: {num_workers}, スレッド/レプリカ: {cpu_threads})",
+                      category="モデル", print_console=False)
+        
+        # モデルをロード（config.jsonの設定を使用）
+        load_start = time.time()
+        try:
+            # 固定済みのワーカーからロードしても、モデルのスレッドは使えるすべてのコアで動かす
+            with unpinned_thread():
+                model = create_whisper_model(model_size, compute_type, cpu_threads, num_workers)
+        except ImportError:
+            log_and_print("faster_whisperがインストールされていません。pip install faster-whisperを実行してください。", "error")
+            return None
+        
+        with model_lock:
+            model_pool[key] = model
+            pooled = len(model_pool)
+        observe_model_load(model_size, compute_type, time.time() - load_start)
+        log_and_print(f"モデルロード完了: Whisper {model_size} ({time.time() - load_start:.1f}秒, "
+                      f"保持中: {pooled}モデル)", category="モデル", print_console=False)
+        
+        return model
+    finally:
+        # 待っているスレッドを起こす（失敗した場合は待っていたスレッドがロードし直す）
+        with model_lock:
+            del model_loading[key]
+        loading.set()
+
+def preload_model():
+    """設定中のモデルを先読み（最初のファイルでロード待ちが発生しないようにする）"""
+    try:
+        get_whisper_model()
+    except Exception as e:
+        log_and_print(f"モデルの先読みに失敗しました: {e}", "warning", category="モデル")
+
+def start_model_preload():
+    """モデルの先読みスレッドを開始"""
+    global model_preload_thread
+    
+    if not config.get("preload_model", True):
+        return
+    
+    model_preload_thread = threading.Thread(target=preload_model, name="koemoji-preload")
+    model_preload_thread.daemon = True
+    model_preload_thread.start()
+
+def load_audio(file_path):
+    """音声をデコードして16kHzモノラルのfloat配列にする"""
+    from faster_whisper.audio import decode_audio
+    return decode_audio(file_path, sampling_rate=SAMPLE_RATE)
+
+def transcribe_audio(file_path, output_file, model_size=None, audio=None, speech_range=None):
+    """音声ファイルを文字起こしし、セグメントを順次output_fileに書き出す
+    
+    戻り値は書き出したセグメント数（失敗・停止時はNone）。
+    途中で中断した場合はチェックポイントが残り、次回はその位置から再開する。
+    audio・speech_rangeは事前判定でデコード済みの音声と発話のある範囲（秒）。
+    """
+    global stop_requested
+    
+    # 停止要求をチェック（この関数の先頭で確認）
+    if stop_requested:
+        log_and_print("停止要求を検出したため、文字起こしをキャンセルします", "info", print_console=False)
+        return None
+    
+    start_time = time.time()
+    file_name = os.path.basename(file_path)
+    
+    try:
+        # 先読み済みのデコード結果があれば使う（なければfaster-whisperにパスを渡してデコード）
+        if audio is None:
+            with trace_stage("decode"):
+                audio = take_prefetched_audio(file_path)
+                trace_set("prefetched", audio is not None)
+                if audio is None and is_tracing():
+                    # トレース時はデコード時間を分けて計測するため、ここでデコードしておく
+                    audio = load_audio(file_path)
+        if audio is None:
+            audio = file_path
+        
+        # 事前判定で見つけた先頭・末尾の長い無音を除く（以降の時刻はtrim_startからの相対）
+        trim_start = 0.0
+        if speech_range is not None:
+            trim_start, trim_end = speech_range
+            # RTFは録音全体の長さで計算する（発話のある範囲の長さは別に記録）
+            trace_set("audio_seconds", len(audio) / SAMPLE_RATE)
+            trace_set("speech_seconds", round(trim_end - trim_start, 3))
+            audio = audio[int(trim_start * SAMPLE_RATE):int(trim_end * SAMPLE_RATE)]
+        
+        # 長時間の録音は分割して並列に文字起こし（2段階デコードは区間の再推論に音声配列が必要）
+        if config.get("chunked_transcription", False) or is_two_pass():
+            if isinstance(audio, str):
+                with trace_stage("decode"):
+                    audio = load_audio(file_path)
+            duration = len(audio) / SAMPLE_RATE
+            if speech_range is None:
+                trace_set("audio_seconds", duration)
+            if (config.get("chunked_transcription", False) and
+                    duration >= config.get("chunk_min_minutes", 20) * 60):
+                with trace_stage("model_load"):
+                    model = get_whisper_model(model_size, chunked=True)
+                if model is None:
+                    return None
+                return transcribe_chunked(model, audio, file_name, output_file, start_time)
+        
+        with trace_stage("model_load"):
+            model = get_whisper_model(model_size)
+        if model is None:
+            return None
+        
+        # 文字起こし開始前に再度停止要求をチェック
+        if stop_requested:
+            log_and_print("処理をキャンセル（停止要求）", category="処理", print_console=False)
+            return None
+        
+        # 前回の途中結果があれば続きから再開
+        output = open_transcript_output(output_file, file_path)
+        offset = output["end"]
+        base = max(offset, trim_start)  # 推論する音声の先頭の、元の音声での時刻
+        if offset > 0:
+            if isinstance(audio, str):
+                with trace_stage("decode"):
+                    audio = load_audio(file_path)
+            audio = audio[int((base - trim_start) * SAMPLE_RATE):]
+            log_and_print(f"音声認識再開: {file_name} - {offset:.1f}秒から ({output['segments']}セグメント処理済み)",
+                          category="処理", print_console=False)
+        else:
+            log_and_print(f"音声認識開始: {file_name}", category="処理", print_console=False)
+        
+        try:
+            # 文字起こし実行（transcribe()の呼び出し自体でVADと特徴量抽出が行われる）
+            with trace_stage("vad_features"):
+                segments, info = get_transcriber(model).transcribe(
+                    audio,
+                    language=config.get("language", "ja"),
+                    **get_decoding_options()
+                )
+            if speech_range is None:
+                trace_set("audio_seconds", base + info.duration)
+            
+            # セグメントを生成され次第ファイルに追記（メモリに溜めない）
+            redecoded = 0
+            segment_total = 0
+            segment_iter = iter(segments)
+            while True:
+                # 推論はジェネレータから次のセグメントを取り出すときに実行される
+                with trace_stage("decoding"):
+                    segment = next(segment_iter, None)
+                if segment is None:
+                    break
+                
+                text, refined = refine_segment_text(model, audio, segment)
+                redecoded += refined
+                segment_total += 1
+                
+                with trace_stage("output_write"):
+                    append_transcript_segment(output, text, base + segment.end)
+                
+                # 10セグメントごとに進捗をログに記録
+                if output["segments"] % 10 == 0:
+                    log_and_print(f"進捗: {output['segments']}セグメント処理済み", category="処理", print_console=False)
+                
+                if stop_requested:
+                    log_and_print(f"処理をキャンセル（停止要求）: {output['end']:.1f}秒まで保存済み", category="処理", print_console=False)
+                    return None
+        finally:
+            output["file"].close()
+        
+        with trace_stage("output_write"):
+            segment_count = finalize_transcript_output(output, output_file)
+        trace_set("segments", segment_count)
+        log_two_pass_stats(file_name, redecoded, segment_total)
+        
+        # 処理時間を計算
+        processing_time = time.time() - start_time
+        log_and_print(f"文字起こし完了: {file_name} - 合計{segment_count}セグメント (処理時間: {processing_time:.2f}秒)")
+        
+        return segment_count
+    
+    except Exception as e:
+        log_and_print(f"文字起こし処理中にエラーが発生しました: {e}", "error")
+        return None
+
+#=======================================================================
+# 音声デコードの先読み
+#=======================================================================
+
+def estimate_decoded_bytes(job):
+    """デコード後の音声のサイズを見積もる（16kHzモノラルのfloat32）"""
+    duration = job.get("duration") or (job.get("size") or 0) / ESTIMATED_BYTES_PER_SECOND
+    return int(duration * SAMPLE_RATE * 4)
+
+def take_prefetched_audio(file_path):
+    """先読み済みの音声を取り出す（デコード中なら完了を待つ、なければNone）"""
+    with prefetch_cond:
+        while file_path in prefetch_inflight:
+            prefetch_cond.wait()
+        
+        entry = prefetch_cache.pop(file_path, None)
+    
+    if entry is None:
+        return None
+    
+    signature, audio = entry
+    try:
+        if get_source_signature(file_path) != signature:
+            return None  # 先読み後にファイルが変わった
+    except OSError:
+        return None
+    
+    log_and_print(f"先読み済みの音声を使用: {os.path.basename(file_path)}", category="処理", print_console=False)
+    return audio
+
+def prefetch_next_audio():
+    """次に処理されるファイルをデコードしてメモリに置く（1件処理したらTrue）"""
+    max_bytes = config.get("prefetch_max_mb", 512) * 1024 * 1024
+    upcoming = select_queued_jobs(config.get("prefetch_files", 2))
+    keep_paths = {job["path"] for job in upcoming} | get_running_paths()
+    
+    with prefetch_cond:
+        # 順番が入れ替わって先頭から外れたものは捨てる（処理が始まったものはワーカーが取り出すまで残す）
+        for path in [path for path in prefetch_cache if path not in keep_paths]:
+            del prefetch_cache[path]
+        for path in [path for path in prefetch_failed if path not in keep_paths]:
+            del prefetch_failed[path]
+        used_bytes = sum(audio.nbytes for _, audio in prefetch_cache.values())
+        
+        target = None
+        for job in upcoming:
+            if job["path"] in prefetch_cache or job["path"] in prefetch_inflight:
+                continue
+            if job["path"] in prefetch_failed and is_same_source(job["path"], prefetch_failed[job["path"]]):
+                continue  # 前回デコードに失敗した（本処理でエラーとして扱う）
+            if used_bytes + estimate_decoded_bytes(job) > max_bytes:
+                break  # メモリ上限を超えるので、前のファイルが処理されるまで待つ
+            target = job["path"]
+            prefetch_inflight.add(target)
+            break
+    
+    if target is None:
+        return False
+    
+    signature = None
+    try:
+        signature = get_source_signature(target)
+        audio = load_audio(target)
+        with prefetch_cond:
+            prefetch_cache[target] = (signature, audio)
+        logger.debug(f"先読み完了: {os.path.basename(target)} ({audio.nbytes / 1024 / 1024:.1f}MB)")
+    except Exception as e:
+        # デコードできないファイルは本処理でエラーとして扱う（キューが変わるまで待つ）
+        logger.debug(f"先読みをスキップ: {os.path.basename(target)} - {e}")
+        with prefetch_cond:
+            prefetch_failed[target] = signature
+        return False
+    finally:
+        with prefetch_cond:
+            prefetch_inflight.discard(target)
+            prefetch_cond.notify_all()
+    
+    return True
+
+def is_same_source(file_path, signature):
+    """元ファイルが記録した識別情報から変わっていないか（見つからなければ変わっていないとみなす）"""
+    try:
+        return get_source_signature(file_path) == signature
+    except OSError:
+        return True
+
+def prefetch_loop():
+    """先読みスレッドのループ：推論中に次のファイルのデコードを済ませておく"""
+    try:
+        while is_running and not stop_requested:
+            if not prefetch_next_audio():
+                # キューの変化を待つ（最大1秒）
+                if prefetch_event.wait(1):
+                    prefetch_event.clear()
+    except Exception as e:
+        log_and_print(f"先読みでエラーが発生しました: {e}", "error", category="システム")
+    finally:
+        with prefetch_cond:
+            prefetch_cache.clear()
+
+def start_prefetcher():
+    """先読みスレッドを開始（prefetch_filesが0なら何もしない）"""
+    global prefetch_thread
+    
+    if config.get("prefetch_files", 2) <= 0:
+        return
+    
+    # クラスタモードでは他のノードが処理するファイルまでデコードしてしまうため使わない
+    if is_cluster_mode():
+        return
+    
+    prefetch_thread = threading.Thread(target=prefetch_loop, name="koemoji-prefetch")
+    prefetch_thread.daemon = True
+    prefetch_thread.start()
+
+#=======================================================================
+# 文字起こし結果の出力（チェックポイント付き）
+#=======================================================================
+
+def get_source_signature(file_path):
+    """元ファイルの識別情報（チェックポイントが同じファイルのものか確認する）"""
+    stat = os.stat(file_path)
+    return {"name": os.path.basename(file_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def open_transcript_output(output_file, file_path, resume=True):
+    """途中結果ファイル（.part）を開く
+    
+    同じ元ファイルのチェックポイントがあれば、最後に保存した位置まで切り詰めて追記モードで開く。
+    戻り値は出力状態の辞書（file, part, checkpoint, end, segments）。
+    """
+    part_path = f"{output_file}.part"
+    checkpoint_path = f"{output_file}.checkpoint.json"
+    signature = get_source_signature(file_path)
+    
+    checkpoint = None
+    if resume and os.path.exists(checkpoint_path) and os.path.exists(part_path):
+        try:
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("source") != signature:
+                checkpoint = None
+        except (OSError, ValueError):
+            checkpoint = None
+    
+    if checkpoint is not None:
+        f = open(part_path, 'r+', encoding='utf-8', newline='')
+        f.seek(checkpoint["bytes"])
+        f.truncate()  # チェックポイント以降に書かれた中途半端な内容を捨てる
+        end = checkpoint["end"]
+        segments = checkpoint["segments"]
+    else:
+        f = open(part_path, 'w', encoding='utf-8', newline='')
+        end = 0.0
+        segments = 0
+    
+    return {
+        "file": f,
+        "part": part_path,
+        "checkpoint": checkpoint_path,
+        "source": signature,
+        "end": end,
+        "segments": segments
+    }
+
+def append_transcript_segment(output, text, end):
+    """セグメントを追記し、チェックポイント（最後の終了時刻）を更新"""
+    f = output["file"]
+    if output["segments"]:
+        f.write("\n")
+    f.write(text)
+    f.flush()
+    
+    output["end"] = end
+    output["segments"] += 1
+    
+    # 一時ファイルに書いてから置き換え（書き込み途中で落ちても壊れない）
+    checkpoint = {
+        "source": output["source"],
+        "end": end,
+        "segments": output["segments"],
+        "bytes": f.tell()
+    }
+    temp_path = f"{output['checkpoint']}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as cf:
+        json.dump(checkpoint, cf)
+    os.replace(temp_path, output["checkpoint"])
+
+def finalize_transcript_output(output, output_file):
+    """途中結果ファイルを完成版に置き換え、チェックポイントを削除（結果が空なら出力しない）"""
+    output["file"].close()
+    if output["segments"]:
+        os.replace(output["part"], output_file)
+    else:
+        os.remove(output["part"])
+    if os.path.exists(output["checkpoint"]):
+        os.remove(output["checkpoint"])
+    return output["segments"]
+
+#=======================================================================
+# 分割並列文字起こし（長時間の録音向け）
+#=======================================================================
+
+def plan_chunks(audio):
+    """音声を無音区間で分割する位置を決める
+    
+    目標の長さに近い無音区間の中央で区切る。適当な無音がなければ目標位置で強制的に区切り、
+    前後のチャンクを重ねて継ぎ目の単語が欠けないようにする。
+    戻り値は(開始サンプル, 終了サンプル)のリスト。
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    
+    total = len(audio)
+    target = int(config.get("chunk_seconds", 600) * SAMPLE_RATE)
+    overlap = int(config.get("chunk_overlap_seconds", 2) * SAMPLE_RATE)
+    
+    # 発話区間の間（無音区間）の中央を区切り位置の候補にする
+    speech = get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=500))
+    cut_candidates = [(prev["end"] + cur["start"]) // 2 for prev, cur in zip(speech, speech[1:])]
+    
+    chunks = []
+    start = 0
+    while total - start > target * 3 // 2:
+        ideal = start + target
+        candidates = [c for c in cut_candidates if start + target // 2 <= c <= start + target * 3 // 2]
+        if candidates:
+            cut = min(candidates, key=lambda c: abs(c - ideal))
+            chunks.append((start, cut))
+            start = cut
+        else:
+            chunks.append((start, min(total, ideal + overlap)))
+            start = ideal
+    chunks.append((start, total))
+    
+    return chunks
+
+def transcribe_chunk(model, audio, chunk_start, chunk_end):
+    """1チャンクを文字起こしし、(絶対開始秒, 絶対終了秒, テキスト, 再推論したか)のリストを返す"""
+    if stop_requested:
+        return []
+    
+    offset = chunk_start / SAMPLE_RATE
+    chunk_audio = audio[chunk_start:chunk_end]
+    segments, _ = get_transcriber(model).transcribe(
+        chunk_audio,
+        language=config.get("language", "ja"),
+        **get_decoding_options()
+    )
+    
+    results = []
+    for segment in segments:
+        text, refined = refine_segment_text(model, chunk_audio, segment)
+        results.append((offset + segment.start, offset + segment.end, text, refined))
+    return results
+
+def stitch_chunks(chunk_results):
+    """チャンクごとの結果を順番につなぐ（重なり部分の重複セグメントは除く）"""
+    stitched = []
+    last_end = 0.0
+    for segments in chunk_results:
+        for start, end, text, _ in segments:
+            # 前のチャンクで既に出力済みの区間にあるセグメントはスキップ
+            if stitched and (start + end) / 2 < last_end:
+                continue
+            stitched.append(text)
+            last_end = end
+    return stitched
+
+def transcribe_chunked(model, audio, file_name, output_file, start_time):
+    """長時間の音声を分割し、チャンクを並列に文字起こしする"""
+    from concurrent.futures import ThreadPoolExecutor
+    
+    with trace_stage("vad_features"):
+        chunks = plan_chunks(audio)
+    trace_set("chunks", len(chunks))
+    parallelism = min(len(chunks), get_chunk_parallelism())
+    log_and_print(f"分割文字起こし開始: {file_name} - {len(chunks)}チャンク (並列数: {parallelism})",
+                  category="処理", print_console=False)
+    
+    # モデルのレプリカ数（num_workers）まで同時に推論できる
+    with trace_stage("decoding"), \
+         ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="koemoji-chunk") as executor:
+        futures = [executor.submit(transcribe_chunk, model, audio, chunk_start, chunk_end)
+                   for chunk_start, chunk_end in chunks]
+        chunk_results = []
+        for index, future in enumerate(futures, 1):
+            chunk_results.append(future.result())
+            log_and_print(f"進捗: {index}/{len(chunks)}チャンク処理済み", category="処理", print_console=False)
+    
+    if stop_requested:
+        log_and_print("処理をキャンセル（停止要求）", category="処理", print_console=False)
+        return None
+    
+    # 並列処理のためチェックポイントからの再開はせず、完了後にまとめて書き出す
+    transcription = stitch_chunks(chunk_results)
+    segment_count = len(transcription)
+    trace_set("segments", segment_count)
+    log_two_pass_stats(file_name, sum(segment[3] for segments in chunk_results for segment in segments),
+                       sum(len(segments) for segments in chunk_results))
+    if segment_count:
+        with trace_stage("output_write"), open(output_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(transcription))
+    
+    processing_time = time.time() - start_time
+    log_and_print(f"文字起こし完了: {file_name} - 合計{segment_count}セグメント / {len(chunks)}チャンク "
+                  f"(処理時間: {processing_time:.2f}秒)")
+    
+    return segment_count
+
+#=======================================================================
+# ファイル処理
+#=======================================================================
+
+def scan_and_queue_files():
+    """入力フォルダをスキャンしてファイルをキューに追加"""
+    global stop_requested
+    
+    if stop_requested:
+        return
+    
+    try:
+        logger.debug("入力フォルダのスキャンを開始します")
+        
+        input_folder = config.get("input_folder")
+        if not os.path.exists(input_folder):
+            log_and_print(f"入力フォルダが存在しません: {input_folder}", "warning")
+            ensure_directory(input_folder)
+            return
+        
+        # 失敗したファイルの再試行（フォルダに変化がなくても対象にする）
+        for file_path in get_retryable_paths(config.get("job_max_attempts", 3)):
+            if os.path.isfile(file_path):
+                is_file_queued_or_processing(file_path)
+        
+        # 新しいファイルを検出（サブフォルダも含め、前回から変化のあった分のみ）
+        new_files = scan_input_tree(input_folder)
+        if not new_files:
+            logger.debug("新しいファイルはありません")
+            return
+        
+        # 書き込みが終わっているファイルはキューに追加、コピー中のファイルは完了を待つ
+        # 索引にはキューに登録したファイルだけを記録する（完了待ち・終了待ちのファイルや
+        # 途中で失敗した残りのファイルは、次回のスキャンで再び候補になる）
+        for file_path in new_files:
+            try:
+                if is_file_queued_or_processing(file_path):
+                    # 既に処理中またはキュー済み
+                    save_scan_file(file_path, os.stat(file_path))
+                else:
+                    queue_when_settled(file_path)
+            except FileNotFoundError:
+                # スキャン後に移動・削除された（クラスタモードでは他のノードが確保した）
+                logger.debug(f"スキャン後に見つからなくなりました: {os.path.basename(file_path)}")
+        
+        log_and_print(f"キュー状態: {count_jobs('queued')}件待機中 (書き込み完了待ち: {len(pending_files)}件)",
+                      category="キュー", print_console=False)
+        
+    except Exception as e:
+        log_and_print(f"キュースキャン中エラー: {e}", "error", category="キュー")
+
+def queue_file(file_path, source="scan"):
+    """1ファイルをキューに追加（scan: 定期スキャン / watch: フォルダ監視 / control: 制御ソケット）"""
+    if is_draining:
+        return None  # 終了待ちの間は新しいファイルを受け付けない
+    
+    with pending_lock:
+        pending_files.pop(file_path, None)
+    
+    file_name = os.path.basename(file_path)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        logger.debug(f"キュー追加前に見つからなくなりました: {file_name}")
+        return None
+    
+    # ファイル情報のメタデータを作成
+    # dropped_atは投入時刻の推定値（コピー時にmtimeが保持される場合に備えctimeも見る）
+    file_info = {
+        "path": file_path,
+        "name": file_name,
+        "size": stat.st_size,
+        "queued_at": time.time(),
+        "dropped_at": max(stat.st_mtime, stat.st_ctime),
+        "detected_at": time.time(),
+        "source": source,
+        "duration": probe_media_duration(file_path),
+        "priority": get_folder_priority(file_path)
+    }
+    
+    # 監視とスキャンが同時に同じファイルを見つけても、索引により二重登録されない
+    file_info["id"] = insert_job(file_info)
+    if source == "scan":
+        save_scan_file(file_path, stat)
+    if file_info["id"] is None:
+        return None
+    
+    queue_event.set()
+    prefetch_event.set()
+    log_and_print(f"キュー追加: {file_name}", category="キュー", print_console=False)
+    return file_info
+
+def queue_when_settled(file_path):
+    """書き込みが終わっていればキューに追加し、まだ変化しているなら完了待ちに登録
+    
+    キューに追加した場合はTrueを返す。完了待ちのファイルはcheck_pending_filesで再確認する。
+    """
+    settle_seconds = config.get("file_settle_seconds", 10)
+    if not settle_seconds:
+        return queue_file(file_path) is not None
+    
+    with pending_lock:
+        if file_path in pending_files:
+            return False
+        stat = os.stat(file_path)
+        pending_files[file_path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                    "changed_at": None, "unstable": False}
+    
+    logger.debug(f"書き込み完了待ち: {os.path.basename(file_path)}")
+    return False
+
+def check_pending_files():
+    """書き込み完了待ちのファイルを再確認し、サイズ・更新時刻が落ち着いたものをキューに追加
+    
+    前回の観測から変化がなく、最後の変化（観測した変化・ファイルの更新時刻の遅い方）から
+    file_settle_seconds以上経っていれば書き込み完了とみなす。
+    """
+    settle_seconds = config.get("file_settle_seconds", 10)
+    now = time.time()
+    settled = []
+    
+    with pending_lock:
+        for file_path, observed in list(pending_files.items()):
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                del pending_files[file_path]  # コピーの取り消し・移動
+                continue
+            
+            if (stat.st_size, stat.st_mtime_ns) != (observed["size"], observed["mtime_ns"]):
+                # まだ書き込み中
+                if not observed["unstable"]:
+                    observe_unstable_file()
+                    log_and_print(f"書き込み中のため待機: {os.path.basename(file_path)}",
+                                  category="キュー", print_console=False)
+                observed.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, changed_at=now, unstable=True)
+                continue
+            
+            last_change = max(observed["changed_at"] or 0, stat.st_mtime, stat.st_ctime)
+            if now - last_change >= settle_seconds:
+                settled.append((file_path, observed, stat))
+    
+    for file_path, observed, stat in settled:
+        if observed["unstable"]:
+            log_and_print(f"書き込み完了を確認: {os.path.basename(file_path)}", category="キュー", print_console=False)
+        if is_file_queued_or_processing(file_path):
+            with pending_lock:
+                pending_files.pop(file_path, None)
+            save_scan_file(file_path, stat)
+            continue
+        queue_file(file_path)
+
+def get_folder_priority(file_path):
+    """入力フォルダ内のサブフォルダに設定された優先度（秒換算、未設定なら0）
+    
+    folder_prioritiesには入力フォルダからの相対パスを指定する（例: {"urgent": 3600}）。
+    サブフォルダ自体に設定がなければ、上位のフォルダの設定を使う。
+    """
+    priorities = config.get("folder_priorities", {})
+    if not priorities:
+        return 0
+    
+    parts = Path(get_relative_folder(file_path)).parts
+    for depth in range(len(parts), 0, -1):
+        folder = "/".join(parts[:depth])
+        if folder in priorities:
+            return priorities[folder]
+    return priorities.get(".", 0)
+
+def is_file_queued_or_processing(file_path):
+    """ファイルを新たにキューに入れる必要がないか確認
+    
+    待機中・処理中のジョブがある場合に加え、再試行の上限まで失敗したファイルも対象外とする。
+    失敗回数が上限未満のファイルは、このタイミングで待機中に戻す。
+    """
+    job = get_latest_job(file_path)
+    if job is None or job["state"] in ("done", "skipped"):
+        return False
+    
+    if job["state"] == "failed":
+        if job["attempts"] < config.get("job_max_attempts", 3):
+            requeue_job(job["id"])
+            queue_event.set()
+            log_and_print(f"再試行キュー追加: {job['name']} ({job['attempts'] + 1}回目)", category="キュー", print_console=False)
+        return True
+    
+    return True
+
+def sample_resources():
+    """CPU使用率・空きメモリ・ロードアベレージを測定し、平滑化して保存"""
+    cpu_percent = psutil.cpu_percent(interval=None)  # 前回呼び出しからの使用率（ブロックしない）
+    memory = psutil.virtual_memory()
+    load_average = os.getloadavg()[0] if hasattr(os, "getloadavg") else None
+    
+    alpha = config.get("resource_smoothing", 0.3)
+    with resource_lock:
+        previous = resource_snapshot.get("cpu_percent")
+        if previous is not None:
+            cpu_percent = previous + alpha * (cpu_percent - previous)
+        resource_snapshot.update({
+            "cpu_percent": cpu_percent,
+            "memory_available_mb": memory.available / 1024 / 1024,
+            "load_average": load_average,
+            "sampled_at": time.time(),
+        })
+
+def resource_sampler_loop():
+    """リソース使用状況を定期的に測定（ワーカーは測定を待たずに最新値を参照する）"""
+    interval = config.get("resource_sample_interval", 1.0)
+    admitted = True
+    
+    while is_running and not stop_requested:
+        try:
+            sample_resources()
+            
+            # 混雑・空きメモリ不足が解消したら、待たせていたワーカーを起こす
+            now_admitted = is_host_busy() is None and is_memory_released()
+            if now_admitted and not admitted:
+                queue_event.set()
+            admitted = now_admitted
+        except Exception as e:
+            log_and_print(f"リソース測定でエラーが発生しました: {e}", "error", category="システム")
+        time.sleep(interval)
+
+def start_resource_sampler():
+    """リソース測定スレッドを起動（初回の値は起動時に同期的に測定）"""
+    global resource_sampler_thread
+    
+    with resource_lock:
+        resource_snapshot.clear()
+    psutil.cpu_percent(interval=None)  # 初回呼び出しは基準値の取得のみ
+    sample_resources()
+    
+    resource_sampler_thread = threading.Thread(target=resource_sampler_loop, name="koemoji-sampler")
+    resource_sampler_thread.daemon = True
+    resource_sampler_thread.start()
+
+def get_resource_snapshot():
+    """最新のリソース使用状況を取得（未測定なら空の辞書）"""
+    with resource_lock:
+        return dict(resource_snapshot)
+
+def is_host_busy():
+    """CPU・ロードアベレージが上限を超えていれば理由を返す（余裕があればNone）"""
+    snapshot = get_resource_snapshot()
+    
+    max_cpu = config.get("max_cpu_percent", 95)
+    cpu_percent = snapshot.get("cpu_percent")
+    if cpu_percent is not None and cpu_percent > max_cpu:
+        return f"CPU使用率 {cpu_percent:.0f}% > {max_cpu}%"
+    
+    max_load = config.get("max_load_per_core", 0)
+    load_average = snapshot.get("load_average")
+    if max_load and load_average is not None:
+        load_per_core = load_average / get_usable_cores()
+        if load_per_core > max_load:
+            return f"ロードアベレージ {load_per_core:.2f}/コア > {max_load}"
+    
+    return None
+
+def is_memory_released():
+    """空きメモリ不足による見送りが解消したか（見送り中でなければTrue）"""
+    global memory_held_model
+    
+    held_model = memory_held_model
+    if held_model is None:
+        return True
+    if fit_model_to_memory(held_model) is None:
+        return False
+    
+    memory_held_model = None
+    log_and_print("空きメモリが回復したため、新しいジョブの開始を再開します", category="モデル", print_console=False)
+    return True
+
+def admit_next_job(worker_id):
+    """新しいジョブを開始してよいか判定（測定済みの値を参照するだけでブロックしない）
+    
+    実行中のジョブがなければ混雑していても1件は開始する（処理が止まらないようにする）。
+    空きメモリ不足でモデルをロードできない間は、実行中のジョブの有無にかかわらず開始しない。
+    """
+    reason = None
+    if count_jobs("running") > 0:
+        reason = is_host_busy()
+    
+    now = time.time()
+    if reason is not None:
+        if worker_id not in admission_denied_since:
+            admission_denied_since[worker_id] = now
+            log_and_print(f"ワーカー{worker_id}: 新しいジョブの開始を見送ります（{reason}）",
+                          category="処理", print_console=False)
+        return False
+    
+    # 空きメモリ不足で見送り中なら、そのモデル（または小さいモデル）が収まるまで待つ
+    if not is_memory_released():
+        admission_denied_since.setdefault(worker_id, now)
+        return False
+    
+    # 見送っていた時間をリソース待ち時間として記録
+    denied_since = admission_denied_since.pop(worker_id, None)
+    if denied_since is not None:
+        observe_resource_wait(now - denied_since)
+    return True
+
+def fit_model_to_memory(model_size):
+    """空きメモリに収まるモデルを選ぶ（ロード済みならそのまま、足りなければより小さいモデル）
+    
+    どのモデルも収まらない場合はNoneを返す。
+    """
+    compute_type = config.get("compute_type", "int8")
+    if is_model_resident(model_size, compute_type):
+        return model_size
+    
+    # 先読み中のモデルはすでにメモリを確保しつつあるので、そのまま待つ
+    preloading = model_preload_thread is not None and model_preload_thread.is_alive()
+    if preloading and model_size == config.get("whisper_model", "large"):
+        return model_size
+    
+    available = get_resource_snapshot().get("memory_available_mb")
+    if available is None:
+        return model_size
+    headroom = available - config.get("min_free_memory_mb", 1024)
+    
+    # 指定モデル、adaptive_modelsのうちそれより小さいモデルの順に試す
+    candidates = [model_size]
+    adaptive_models = config.get("adaptive_models", ["large", "medium", "small"])
+    if model_size in adaptive_models:
+        candidates += adaptive_models[adaptive_models.index(model_size) + 1:]
+    
+    for candidate in candidates:
+        loaded = is_model_resident(candidate, compute_type)
+        if loaded or estimate_model_memory_mb(candidate, compute_type) <= headroom:
+            return candidate
+    return None
+
+def hold_for_memory(model_size):
+    """空きメモリが増えるまで新しいジョブの開始を見送る（警告は見送り始めに1回だけ）
+    
+    見送り中はadmit_next_jobがジョブを確保する前に判定するため、確保と差し戻しを繰り返さない。
+    """
+    global memory_held_model
+    
+    if memory_held_model is None:
+        available = get_resource_snapshot().get("memory_available_mb") or 0
+        log_and_print(f"空きメモリ不足のためモデルをロードできません: {model_size} (空き{available:.0f}MB)。"
+                      f"空きメモリが増えるまで新しいジョブの開始を見送ります", "warning", category="モデル", print_console=False)
+    memory_held_model = model_size
+
+def process_next_file(worker_id=1):
+    """キューの次のファイルを処理"""
+    global stop_requested, completed_count
+    
+    if stop_requested or not is_running or is_paused:
+        return False
+    
+    job = None
+    claimed_path = None
+    try:
+        if count_jobs("queued") == 0:
+            return False  # 処理すべきファイルなし
+        
+        # 混雑時は新しいジョブを開始しない（サンプラーが混雑解消時にワーカーを起こす）
+        if not admit_next_job(worker_id):
+            return False
+        
+        # 次のファイルを取得（他のワーカーと取り合わないようジョブストア上で確保する）
+        job = claim_next_job()
+        if job is None:
+            return False
+        prefetch_event.set()  # 先頭が処理に回ったので次のファイルを先読み
+        
+        # クラスタモードでは共有フォルダ上でファイルを確保する（他のノードが先に確保していれば次へ）
+        file_path = job["path"]
+        if is_cluster_mode() and is_shared_input(file_path):
+            claimed_path = claim_shared_file(file_path)
+            original_path = file_path
+            if claimed_path is None:
+                finish_job(job["id"], "skipped")
+                job = None
+                return True
+            file_path = claimed_path
+        
+        # 待機中の量に応じてモデルを選ぶ（目標未設定ならwhisper_model）
+        # さらに空きメモリに収まらなければ小さいモデルに切り替える
+        requested_model = select_model_for_backlog(job)
+        model_size = fit_model_to_memory(requested_model)
+        if model_size is None:
+            requeue_job(job["id"], count_attempt=False)
+            hold_for_memory(requested_model)
+            job = None
+            return False
+        if model_size != requested_model:
+            available = get_resource_snapshot().get("memory_available_mb") or 0
+            log_and_print(f"空きメモリ不足のためモデルを変更: {requested_model} → {model_size} "
+                          f"(空き{available:.0f}MB)", "warning", category="モデル", print_console=False)
+        job["model"] = model_size
+        set_job_model(job["id"], job["model"])
+        
+        worker_status[worker_id] = f"{job['name']} ({job['model']})"
+        
+        # 処理開始（設定時はジョブごとのトレース・プロファイルを記録）
+        start_job_trace(job)
+        with profile_job(job):
+            result = process_file(file_path, job)
+        
+        if result is not None:
+            finish_job(job["id"], "done", output_path=result)
+            with stats_lock:
+                completed_count += 1
+            observe_job_finished("done", time.time() - job["queued_at"])
+            log_pickup_latency(job)
+            log_throughput()
+        elif stop_requested:
+            # 停止による中断は失敗扱いにせず、次回起動時に再開する
+            requeue_job(job["id"], count_attempt=False)
+        else:
+            finish_job(job["id"], "failed", error="文字起こし失敗")
+            observe_job_finished("failed")
+        job = None
+        return result is not None
+    
+    except Exception as e:
+        log_and_print(f"ファイル処理中にエラーが発生しました: {e}", "error")
+        if job is not None:
+            finish_job(job["id"], "failed", error=str(e))
+            observe_job_finished("failed")
+        return False
+    finally:
+        # 処理しきれなかったファイル（アーカイブされずに残ったもの）は共有フォルダに戻す
+        if claimed_path is not None and os.path.exists(claimed_path):
+            release_shared_file(claimed_path, original_path)
+        finish_job_trace()
+        worker_status[worker_id] = "待機中"
+
+def log_pickup_latency(file_info):
+    """投入から検出・文字起こし完了までの遅延をログに記録"""
+    dropped_at = file_info.get("dropped_at")
+    if dropped_at is None:
+        return
+    
+    pickup = max(0.0, file_info["detected_at"] - dropped_at)
+    total = max(0.0, time.time() - dropped_at)
+    log_and_print(f"遅延: {file_info['name']} - 検出まで{pickup:.2f}秒 / 文字起こし完了まで{total:.2f}秒 "
+                  f"(検出方法: {file_info.get('source', 'scan')})",
+                  category="キュー", print_console=False)
+
+def log_throughput():
+    """処理開始からの累計スループットをログに記録"""
+    if processing_started_at is None:
+        return
+    
+    elapsed = time.time() - processing_started_at
+    if elapsed <= 0:
+        return
+    
+    files_per_hour = completed_count / elapsed * 3600
+    log_and_print(f"スループット: {completed_count}件完了 / {elapsed / 60:.1f}分経過 "
+                  f"({files_per_hour:.1f}件/時, ワーカー{len(worker_threads)}個)",
+                  category="処理", print_console=False)
+
+def process_file(file_path, job=None):
+    """ファイルを処理する（jobがあれば選択済みのモデルを使い、実時間係数を記録する）"""
+    global stop_requested
+    
+    if stop_requested:
+        return None
+    
+    start_time = time.time()
+    try:
+        # ファイルが存在するか確認
+        if not os.path.exists(file_path):
+            log_and_print(f"ファイルが存在しません: {file_path}", "warning", category="ファイル")
+            return None
+        
+        file_name = os.path.basename(file_path)
+        log_and_print(f"処理開始: {file_name}", category="ファイル", print_console=False)
+        
+        # 出力ファイルパスを生成（入力フォルダのサブフォルダ構成をそのまま反映）
+        # クラスタモードで確保したファイルは、元の場所（job["path"]）を基準にする
+        relative_folder = get_relative_folder((job or {}).get("path") or file_path)
+        output_folder = config.get("output_folder")
+        output_path = Path(output_folder) / relative_folder
+        output_path.mkdir(parents=True, exist_ok=True)
+        
+        output_file = output_path / f"{Path(file_name).stem}.txt"
+        
+        model_size = (job or {}).get("model") or config.get("whisper_model", "large")
+        
+        # 同じ内容のファイルを処理済みならキャッシュから取得
+        cache_key = None
+        cached = None
+        silent = False
+        if config.get("transcript_cache", True):
+            with trace_stage("cache_lookup"):
+                cache_key = get_cache_key(file_path, model_size)
+                cached = lookup_cached_transcript(cache_key)
+            log_cache_stats(file_name, cached is not None)
+        trace_set("model", model_size)
+        trace_set("cache_hit", cached is not None)
+        
+        if cached is not None:
+            with trace_stage("output_write"), open(output_file, 'w', encoding='utf-8') as f:
+                f.write(cached)
+            segment_count = len(cached.splitlines())
+            trace_set("segments", segment_count)
+        else:
+            # 無音の事前判定（Whisperを使わずに無音ファイルを判定し、前後の長い無音を除く）
+            audio = None
+            speech_range = None
+            if config.get("silence_prepass", False):
+                with trace_stage("decode"):
+                    audio = take_prefetched_audio(file_path)
+                    if audio is None:
+                        audio = load_audio(file_path)
+                with trace_stage("silence_prepass"):
+                    speech_range = detect_speech_range(audio)
+                silent = speech_range is None
+                log_silence_stats(file_name, len(audio) / SAMPLE_RATE, speech_range)
+            trace_set("silent", silent)
+            
+            if silent:
+                # 無音ファイルはモデルを使わずに空の結果を出力
+                with trace_stage("output_write"), open(output_file, 'w', encoding='utf-8'):
+                    pass
+                segment_count = 0
+            else:
+                # 文字起こし処理を実行（結果は順次output_fileに書き出される）
+                transcribe_start = time.time()
+                segment_count = transcribe_audio(file_path, str(output_file), model_size, audio, speech_range)
+                
+                duration = (job or {}).get("duration")
+                if segment_count and duration:
+                    transcribe_seconds = time.time() - transcribe_start
+                    set_job_rtf(job["id"], transcribe_seconds / duration)
+                    observe_transcription(model_size, duration, transcribe_seconds)
+        
+        if stop_requested:
+            log_and_print(f"処理中断: {file_name}", "warning", category="ファイル")
+            return None
+        
+        if segment_count or silent:
+            if cached is None and cache_key is not None and not silent:
+                with open(output_file, 'r', encoding='utf-8') as f:
+                    store_cached_transcript(cache_key, f.read())
+            
+            # 処理時間を計算
+            processing_time = time.time() - start_time
+            log_and_print(f"処理完了: {file_name} → {output_file} (モデル: {model_size}, 処理時間: {processing_time:.2f}秒)", category="ファイル")
+            
+            # アーカイブフォルダに移動
+            archive_folder = os.path.join(config.get("archive_folder", "archive"), relative_folder)
+            ensure_directory(archive_folder)
+            
+            archive_path = os.path.join(archive_folder, file_name)
+            with trace_stage("archive"):
+                archive_path = safe_move_file(file_path, archive_path)
+            log_and_print(f"アーカイブ: {file_name}", category="ファイル", print_console=False)
+            
+            return str(output_file)
+        else:
+            log_and_print(f"処理失敗: {file_name}", "error", category="ファイル")
+            return None
+    
+    except Exception as e:
+        log_and_print(f"エラー発生: {file_path} - {e}", "error", category="ファイル")
+        return None
+
+#=======================================================================
+# クラスタモード（共有フォルダでの分担処理）
+#=======================================================================
+# 各ノードは自分のジョブストアを持ち、共有の入力フォルダを全ノードがスキャンする。
+# 処理を始める前に、ファイルを input/.processing/<ノードID>/ へ rename して確保する。
+# renameは原子的なので、同じファイルを確保できるのは1ノードだけになる。
+# ノードは .heartbeat ファイルを定期的に更新し、lease_seconds以上更新されていないノードの
+# 確保中ファイルは他のノードが入力フォルダに戻す（チェックポイントがあれば続きから再開される）。
+
+CLUSTER_FOLDER = ".processing"
+HEARTBEAT_FILE = ".heartbeat"
+
+def is_cluster_mode():
+    """クラスタモードが有効か"""
+    return bool(config.get("cluster_mode", False))
+
+def get_claim_folder(node_id=None):
+    """ノードが確保したファイルを置くフォルダ"""
+    return os.path.join(config.get("input_folder"), CLUSTER_FOLDER, node_id or cluster_node_id)
+
+def is_shared_input(file_path):
+    """共有の入力フォルダ内のファイルか（HTTP・制御ソケットで受け取ったファイルはノード固有）"""
+    try:
+        relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(config.get("input_folder")))
+    except ValueError:
+        return False
+    return not relative.startswith("..")
+
+def claim_shared_file(file_path):
+    """ファイルをこのノードの確保フォルダへrenameし、確保後のパスを返す（他のノードが確保済みならNone）"""
+    relative = os.path.relpath(os.path.abspath(file_path), os.path.abspath(config.get("input_folder")))
+    claimed_path = os.path.join(get_claim_folder(), relative)
+    ensure_directory(os.path.dirname(claimed_path))
+    
+    try:
+        os.rename(file_path, claimed_path)
+    except FileNotFoundError:
+        log_and_print(f"他のノードが処理中のためスキップ: {os.path.basename(file_path)}",
+                      category="キュー", print_console=False)
+        return None
+    
+    logger.debug(f"ファイルを確保しました: {relative} (ノード: {cluster_node_id})")
+    return claimed_path
+
+def release_shared_file(claimed_path, original_path):
+    """確保したファイルを入力フォルダに戻す（失敗・中断時）"""
+    try:
+        ensure_directory(os.path.dirname(original_path))
+        os.rename(claimed_path, original_path)
+    except OSError as e:
+        log_and_print(f"確保したファイルを戻せませんでした: {claimed_path} - {e}", "error", category="キュー")
+
+def touch_heartbeat():
+    """このノードのハートビートを更新し、共有フォルダ上の現在時刻（更新時刻）を返す
+    
+    ノード間の時計のずれを避けるため、期限切れの判定にはファイルサーバーの時刻を使う。
+    """
+    heartbeat_path = os.path.join(get_claim_folder(), HEARTBEAT_FILE)
+    ensure_directory(os.path.dirname(heartbeat_path))
+    with open(heartbeat_path, 'w', encoding='utf-8') as f:
+        f.write(f"{platform.node()} {os.getpid()}\n")
+    return os.stat(heartbeat_path).st_mtime
+
+def recover_expired_claims(now):
+    """ハートビートが期限切れのノードが確保していたファイルを入力フォルダに戻し、戻した件数を返す"""
+    cluster_folder = os.path.join(config.get("input_folder"), CLUSTER_FOLDER)
+    lease_seconds = config.get("lease_seconds", 120)
+    recovered = 0
+    
+    for node_id in os.listdir(cluster_folder):
+        node_folder = os.path.join(cluster_folder, node_id)
+        if node_id == cluster_node_id or not os.path.isdir(node_folder):
+            continue
+        
+        # ハートビートがなければフォルダの更新時刻で判定
+        heartbeat_path = os.path.join(node_folder, HEARTBEAT_FILE)
+        try:
+            last_seen = os.stat(heartbeat_path).st_mtime
+        except FileNotFoundError:
+            last_seen = os.stat(node_folder).st_mtime
+        if now - last_seen < lease_seconds:
+            continue
+        
+        recovered += return_claimed_files(node_folder, f"停止したノード{node_id}のファイルを戻しました")
+        remove_claim_folder(node_folder)
+    
+    return recovered
+
+def return_claimed_files(node_folder, message):
+    """確保フォルダに残っているファイルを入力フォルダの元の場所に戻し、戻した件数を返す"""
+    input_folder = config.get("input_folder")
+    returned = 0
+    
+    for root, _, files in os.walk(node_folder):
+        for name in files:
+            if name == HEARTBEAT_FILE:
+                continue
+            claimed_path = os.path.join(root, name)
+            original_path = os.path.join(input_folder, os.path.relpath(claimed_path, node_folder))
+            try:
+                ensure_directory(os.path.dirname(original_path))
+                os.rename(claimed_path, original_path)
+                returned += 1
+                log_and_print(f"{message}: {name}", "warning", category="キュー")
+            except FileNotFoundError:
+                pass  # 他のノードが先に戻した
+    
+    return returned
+
+def remove_claim_folder(node_folder):
+    """ノードの確保フォルダを削除（ファイルが残っていれば残す）"""
+    try:
+        os.remove(os.path.join(node_folder, HEARTBEAT_FILE))
+    except FileNotFoundError:
+        pass
+    for root, _, _ in os.walk(node_folder, topdown=False):
+        try:
+            os.rmdir(root)
+        except OSError:
+            pass  # 空でない・他のノードが削除済み
+
+def cluster_heartbeat_loop():
+    """ハートビートの更新と、停止したノードのファイルの回収を定期的に行う"""
+    interval = max(1, config.get("lease_seconds", 120) / 4)
+    
+    while is_running and not stop_requested:
+        try:
+            now = touch_heartbeat()
+            if recover_expired_claims(now):
+                scan_and_queue_files()
+        except Exception as e:
+            log_and_print(f"クラスタのハートビート処理でエラーが発生しました: {e}", "error", category="システム")
+        
+        # 停止チェックを兼ねて1秒ずつ待つ
+        deadline = time.time() + interval
+        while time.time() < deadline and is_running and not stop_requested:
+            time.sleep(1)
+
+def start_cluster_node():
+    """クラスタモードのノードとして参加（ハートビートを開始）"""
+    global cluster_node_id, cluster_thread
+    
+    if not is_cluster_mode():
+        return
+    
+    cluster_node_id = config.get("node_id") or f"{platform.node()}-{os.getpid()}"
+    
+    # 同じnode_idで再起動した場合、前回異常終了したときに確保したままのファイルを初回スキャンの前に戻す
+    # （自分のハートビートが新しいため、他のノードは期限切れとみなさず回収しない）
+    return_claimed_files(get_claim_folder(), "前回の起動時に確保したままのファイルを戻しました")
+    touch_heartbeat()
+    
+    cluster_thread = threading.Thread(target=cluster_heartbeat_loop, name="koemoji-cluster")
+    cluster_thread.daemon = True
+    cluster_thread.start()
+    log_and_print(f"クラスタモードで参加しました: ノード {cluster_node_id}", category="システム")
+
+def stop_cluster_node():
+    """クラスタから離脱（確保フォルダを片付ける。処理中だったファイルは各ワーカーが戻し済み）"""
+    if not is_cluster_mode() or cluster_node_id is None:
+        return
+    
+    remove_claim_folder(get_claim_folder())
+    log_and_print(f"クラスタから離脱しました: ノード {cluster_node_id}", category="システム", print_console=False)
+
+#=======================================================================
+# フォルダ監視（inotify）
+#=======================================================================
+
+# inotifyのイベントマスク（linux/inotify.h）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_IGNORED = 0x00008000  # 監視が外れた（フォルダの削除など）
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+def create_inotify_watch(folder):
+    """inotifyでフォルダ監視を開始し、ファイルディスクリプタを返す（Linux専用）"""
+    global inotify_libc
+    import ctypes
+    import ctypes.util
+    
+    inotify_libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    
+    fd = inotify_libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    
+    try:
+        add_inotify_watch(fd, folder)
+    except OSError:
+        os.close(fd)
+        raise
+    
+    return fd
+
+def add_inotify_watch(fd, folder):
+    """フォルダを監視対象に追加（監視済みなら何もしない）"""
+    import ctypes
+    
+    with inotify_lock:
+        if folder in inotify_folders:
+            return
+        
+        # 書き込み完了（close_write）と別フォルダからの移動（moved_to）、サブフォルダの作成を監視
+        wd = inotify_libc.inotify_add_watch(fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), folder)
+        
+        # 名前を変えたフォルダには同じウォッチ記述子が返るため、古いパスの対応を消す
+        previous = inotify_watches.get(wd)
+        if previous is not None:
+            inotify_folders.pop(previous, None)
+        inotify_watches[wd] = folder
+        inotify_folders[folder] = wd
+
+def watch_subfolder(folder):
+    """スキャンで見つけたサブフォルダを監視対象に追加（フォルダ監視が動いていなければ何もしない）"""
+    global inotify_limit_warned
+    
+    fd = inotify_fd
+    if fd is None:
+        return
+    
+    try:
+        add_inotify_watch(fd, folder)
+    except OSError as e:
+        if e.errno == errno.ENOSPC and not inotify_limit_warned:
+            inotify_limit_warned = True
+            log_and_print("監視できるフォルダ数の上限（fs.inotify.max_user_watches）に達しました。"
+                          "残りのサブフォルダは定期スキャンで検出します", "warning", category="システム")
+        else:
+            logger.debug(f"サブフォルダを監視できません: {folder} ({e})")
+
+def parse_inotify_events(data):
+    """inotifyのイベントバッファから（ウォッチ記述子, マスク, 名前）を取り出す"""
+    events = []
+    offset = 0
+    while offset + INOTIFY_EVENT_HEADER.size <= len(data):
+        wd, mask, _, name_len = INOTIFY_EVENT_HEADER.unpack_from(data, offset)
+        offset += INOTIFY_EVENT_HEADER.size
+        name = data[offset:offset + name_len].rstrip(b"\0")
+        offset += name_len
+        events.append((wd, mask, os.fsdecode(name)))
+    
+    return events
+
+def watch_new_folder(folder):
+    """作成・移動されてきたサブフォルダを配下ごと監視し、既にあるファイルをキューに追加
+    
+    監視を追加する前に書き込まれたファイルは通知されないため、ここで一覧を取って拾う
+    （コピー中の可能性があるため、書き込み完了を待ってから追加する）。
+    """
+    stack = [folder]
+    while stack:
+        folder = stack.pop()
+        watch_subfolder(folder)
+        try:
+            with os.scandir(folder) as iterator:
+                for entry in iterator:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(MEDIA_EXTENSIONS) and entry.is_file():
+                        if not is_file_queued_or_processing(entry.path):
+                            queue_when_settled(entry.path)
+        except FileNotFoundError:
+            continue  # 作成直後に移動・削除された
+
+def watch_loop(fd):
+    """inotifyイベントを待ち、書き込みが完了したファイルを即座にキューに追加"""
+    global inotify_fd
+    
+    try:
+        while is_running and not stop_requested:
+            # 1秒ごとに停止チェック
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if not readable:
+                continue
+            
+            for wd, mask, name in parse_inotify_events(os.read(fd, 64 * 1024)):
+                if mask & IN_IGNORED:
+                    # 監視していたフォルダが削除された
+                    with inotify_lock:
+                        folder = inotify_watches.pop(wd, None)
+                        if inotify_folders.get(folder) == wd:
+                            del inotify_folders[folder]
+                    continue
+                
+                folder = inotify_watches.get(wd)
+                if folder is None or not name or name.startswith("."):
+                    continue  # 隠しフォルダ・作業用ファイルは対象外（スキャンと同じ）
+                file_path = os.path.join(folder, name)
+                
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        watch_new_folder(file_path)
+                    continue
+                
+                if not mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or not name.lower().endswith(MEDIA_EXTENSIONS):
+                    continue
+                
+                if not os.path.isfile(file_path) or is_file_queued_or_processing(file_path):
+                    continue
+                
+                queue_file(file_path, source="watch")
+    
+    except Exception as e:
+        log_and_print(f"フォルダ監視でエラーが発生しました: {e}（定期スキャンで継続します）", "error", category="システム")
+    finally:
+        with inotify_lock:
+            if inotify_fd == fd:
+                inotify_fd = None
+                inotify_watches.clear()
+                inotify_folders.clear()
+        os.close(fd)
+
+def start_watcher():
+    """フォルダ監視スレッドを開始（利用できない場合は定期スキャンのみ）"""
+    global watcher_thread, inotify_fd
+    
+    if config.get("watch_mode", "auto") != "auto":
+        return False
+    
+    if platform.system() != "Linux":
+        log_and_print("フォルダ監視はLinuxのみ対応のため、定期スキャンで動作します", category="システム", print_console=False)
+        return False
+    
+    input_folder = config.get("input_folder")
+    try:
+        fd = create_inotify_watch(input_folder)
+    except Exception as e:
+        log_and_print(f"フォルダ監視を開始できません: {e}（定期スキャンで動作します）", "warning", category="システム")
+        return False
+    
+    # サブフォルダはスキャンで見つけたときと、作成・移動を検出したときに監視に加える
+    inotify_fd = fd
+    watcher_thread = threading.Thread(target=watch_loop, args=(fd,), name="koemoji-watcher")
+    watcher_thread.daemon = True
+    watcher_thread.start()
+    
+    log_and_print(f"フォルダ監視を開始しました: {input_folder}", category="システム", print_console=False)
+    return True
+
+#=======================================================================
+# メイン処理ループとスレッド管理
+#=======================================================================
+
+def worker_loop(worker_id):
+    """ワーカースレッドのループ：キューが空になるまでファイルを処理"""
+    worker_status[worker_id] = "待機中"
+    pin_current_worker(worker_id)
+    
+    try:
+        while is_running and not stop_requested:
+            # ファイル処理
+            while process_next_file(worker_id):
+                if stop_requested:
+                    break
+                time.sleep(0.1)  # 短い待機
+            
+            # キュー追加を待つ（停止チェックの頻度も兼ねて最大1秒）
+            if queue_event.wait(1):
+                queue_event.clear()
+    except Exception as e:
+        log_and_print(f"ワーカー{worker_id}でエラーが発生しました: {e}", "error", category="システム")
+    finally:
+        worker_status[worker_id] = "停止"
+
+def start_workers():
+    """設定されたワーカー数だけ処理スレッドを起動"""
+    global worker_threads
+    
+    worker_threads = []
+    worker_status.clear()
+    
+    for worker_id in range(1, get_worker_count() + 1):
+        thread = threading.Thread(target=worker_loop, args=(worker_id,),
+                                  name=f"koemoji-worker-{worker_id}")
+        thread.daemon = True
+        thread.start()
+        worker_threads.append(thread)
+    
+    log_and_print(f"ワーカーを{len(worker_threads)}個起動しました", category="システム", print_console=False)
+
+def processing_loop():
+    """文字起こし処理のメインループ（スレッドで実行）
+    
+    フォルダのスキャンのみを担当し、ファイル処理はワーカースレッドに任せる。
+    """
+    global is_running, stop_requested, processing_started_at
+    
+    try:
+        log_and_print("文字起こし処理を開始しました", category="システム")
+        
+        scan_interval = config.get("scan_interval_minutes", 30) * 60  # 秒に変換
+        last_scan_time = time.time()
+        processing_started_at = time.time()
+        
+        # ワーカー数・スレッド数を決めてからモデルを読み込む（自動調整が有効なら初回のみ計測）
+        apply_thread_tuning()
+        start_model_preload()
+        
+        # クラスタモードならハートビートを開始（他のノードに生存を知らせる）
+        start_cluster_node()
+        
+        # フォルダ監視を先に開始（初回スキャンとの間に投入されたファイルを取りこぼさない）
+        start_watcher()
+        
+        # 初回スキャン（監視が使えない・取りこぼした場合も定期スキャンで拾う）
+        scan_and_queue_files()
+        
+        # ワーカー起動（リソース測定を先に始め、ワーカーは測定値のみ参照する）
+        start_resource_sampler()
+        start_workers()
+        start_prefetcher()
+        
+        # メインループ
+        while is_running and not stop_requested:
+            # 定期的にフォルダをスキャン
+            current_time = time.time()
+            if current_time - last_scan_time >= scan_interval:
+                scan_and_queue_files()
+                last_scan_time = current_time
+            
+            # 書き込み完了待ちのファイルを再確認
+            check_pending_files()
+            
+            # 終了待ちで、キューも実行中のジョブもなくなったら終了
+            if is_draining and count_jobs("queued") == 0 and count_jobs("running") == 0:
+                log_and_print("キューを処理しきったため終了します", category="システム")
+                stop_requested = True
+                break
+            
+            # 短い待機（停止チェックの頻度も兼ねる）
+            time.sleep(1)
+        
+    except Exception as e:
+        log_and_print(f"処理ループでエラーが発生しました: {e}", "error", category="システム")
+    finally:
+        is_running = False
+        for thread in worker_threads:
+            thread.join()
+        stop_cluster_node()
+        log_and_print("文字起こし処理を終了しました", category="システム")
+
+def start_processing():
+    """文字起こし処理を開始"""
+    global is_running, stop_requested, processing_thread, is_paused, is_draining
+    
+    if is_running:
+        return False  # 既に実行中
+    
+    # ジョブストアを開く（前回中断したジョブもここで復元される）
+    try:
+        init_job_store()
+    except Exception as e:
+        log_and_print(f"ジョブストアを開けませんでした: {e}", "error", category="システム")
+        return False
+    
+    # 制御ソケット（設定時のみ、起動は1回だけ）：別のKoeMojiが稼働中なら開始しない
+    if not start_control_server():
+        return False
+    
+    # フラグを設定
+    is_running = True
+    stop_requested = False
+    is_paused = False
+    is_draining = False
+    
+    # /metrics などのローカルHTTPサーバー（設定時のみ、起動は1回だけ）
+    start_http_server()
+    
+    # 処理スレッドを開始
+    processing_thread = threading.Thread(target=processing_loop)
+    processing_thread.daemon = True  # メインスレッド終了時に自動終了
+    processing_thread.start()
+    
+    return True
+
+
+#=======================================================================
+# 制御ソケット（常駐サービス用）
+#=======================================================================
+
+def get_service_status():
+    """処理状況を辞書で取得（制御ソケットのstatusコマンド用）"""
+    if not is_running:
+        state = "stopped"
+    elif stop_requested:
+        state = "stopping"
+    elif is_draining:
+        state = "draining"
+    elif is_paused:
+        state = "paused"
+    else:
+        state = "running"
+    
+    return {
+        "state": state,
+        "queued": count_jobs("queued") if job_db is not None else 0,
+        "running": count_jobs("running") if job_db is not None else 0,
+        "completed": completed_count,
+        "pending": len(pending_files),
+        "node": cluster_node_id,
+        "workers": {str(worker_id): status for worker_id, status in sorted(worker_status.items())},
+        "resources": get_resource_snapshot(),
+    }
+
+def request_stop(reason):
+    """処理を停止（実行中のジョブは中断され、次回起動時に再開される）"""
+    global stop_requested
+    
+    if not stop_requested:
+        log_and_print(f"停止要求を受け付けました（{reason}）", category="システム")
+    stop_requested = True
+    queue_event.set()
+    prefetch_event.set()
+
+def handle_control_command(line):
+    """制御コマンドを実行して応答を返す"""
+    global is_paused, is_draining
+    
+    command, _, argument = line.strip().partition(" ")
+    
+    if command == "status":
+        return dict(get_service_status(), ok=True)
+    
+    if command == "pause":
+        is_paused = True
+        log_and_print("処理を一時停止しました（実行中のジョブは続行）", category="システム")
+        return {"ok": True, "state": "paused"}
+    
+    if command == "resume":
+        is_paused = False
+        queue_event.set()
+        log_and_print("処理を再開しました", category="システム")
+        return {"ok": True, "state": "running"}
+    
+    if command == "drain":
+        is_draining = True
+        is_paused = False
+        queue_event.set()
+        log_and_print("キューを処理しきったら終了します（新しいファイルは受け付けません）", category="システム")
+        return {"ok": True, "state": "draining"}
+    
+    if command == "enqueue":
+        file_path = os.path.abspath(argument.strip())
+        if not os.path.isfile(file_path):
+            return {"ok": False, "error": f"ファイルが存在しません: {file_path}"}
+        if not file_path.lower().endswith(MEDIA_EXTENSIONS):
+            return {"ok": False, "error": f"対応していない形式です: {file_path}"}
+        if is_file_queued_or_processing(file_path):
+            return {"ok": False, "error": f"既にキューにあります: {file_path}"}
+        file_info = queue_file(file_path, source="control")
+        if file_info is None:
+            return {"ok": False, "error": "キューに追加できませんでした"}
+        return {"ok": True, "job_id": file_info["id"]}
+    
+    if command == "stop":
+        request_stop("制御ソケット")
+        return {"ok": True, "state": "stopping"}
+    
+    return {"ok": False, "error": f"不明なコマンド: {command}"}
+
+class KoemojiControlHandler(socketserver.StreamRequestHandler):
+    """制御ソケットのリクエスト処理（1行1コマンド、応答は1行のJSON）"""
+    
+    def handle(self):
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8', errors='replace')
+            if not line.strip():
+                continue
+            try:
+                response = handle_control_command(line)
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode('utf-8'))
+
+def start_control_server():
+    """制御用Unixソケットを開始（control_socketが空、またはUnixソケット非対応なら何もしない）
+    
+    別のKoeMojiが同じソケットで稼働中の場合はFalseを返す（二重起動の防止）。
+    """
+    global control_server
+    
+    socket_path = config.get("control_socket", "")
+    if not socket_path or control_server is not None:
+        return True
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        # Windowsではconfig.sampleの設定のままでも毎回表示されないよう、ログにのみ記録する
+        logger.debug("この環境ではUnixソケットを使えないため、制御ソケットを無効にします")
+        return True
+    
+    # 前回異常終了したときのソケットファイルだけを削除（稼働中の別インスタンス・通常のファイルは残す）
+    if os.path.lexists(socket_path):
+        reason = check_stale_control_socket(socket_path)
+        if reason:
+            log_and_print(f"制御ソケットを開始できません: {socket_path} - {reason}", "error", category="システム")
+            return False
+        os.unlink(socket_path)
+    
+    try:
+        control_server = socketserver.ThreadingUnixStreamServer(socket_path, KoemojiControlHandler)
+        control_server.daemon_threads = True
+        os.chmod(socket_path, 0o600)  # 同じユーザーのみ操作可能
+    except OSError as e:
+        log_and_print(f"制御ソケットを開始できません: {socket_path} - {e}", "error", category="システム")
+        control_server = None
+        return True
+    
+    thread = threading.Thread(target=control_server.serve_forever, name="koemoji-control")
+    thread.daemon = True
+    thread.start()
+    log_and_print(f"制御ソケットを開始しました: {socket_path}", category="システム", print_console=False)
+    return True
+
+def check_stale_control_socket(socket_path):
+    """既存のソケットファイルを削除してよいか確認（よければNone、だめなら理由）
+    
+    接続を拒否されるソケットは前回異常終了したときの残骸。接続できる場合は別のKoeMojiが稼働中。
+    """
+    if not Path(socket_path).is_socket():
+        return "ソケットではないファイルが存在します"
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        probe.settimeout(1)
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            return None
+        except OSError as e:
+            return f"既存のソケットを確認できません: {e}"
+    return "別のKoeMojiが稼働中です"
+
+def stop_control_server():
+    """制御ソケットを閉じてソケットファイルを削除"""
+    global control_server
+    
+    if control_server is None:
+        return
+    control_server.shutdown()
+    control_server.server_close()
+    control_server = None
+    
+    socket_path = config.get("control_socket", "")
+    if socket_path and os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+def send_control_command(command):
+    """稼働中のKoeMojiに制御コマンドを送り、応答を返す"""
+    socket_path = config.get("control_socket", "")
+    if not socket_path:
+        raise RuntimeError("control_socketが設定されていません")
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(10)
+        client.connect(socket_path)
+        client.sendall((command + "\n").encode('utf-8'))
+        client.shutdown(socket.SHUT_WR)
+        response = client.makefile('r', encoding='utf-8').readline()
+    return json.loads(response)
+
+def run_daemon():
+    """画面表示なしで常駐実行（SIGTERM/SIGINTまたはstop・drainコマンドで終了）"""
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: request_stop(signal.Signals(signum).name))
+    
+    log_and_print("常駐モードで起動しました", category="システム")
+    if not start_processing():
+        log_and_print("処理の開始に失敗しました", level="error", category="システム")
+        return 1
+    
+    # 処理スレッドの終了（ワーカーの停止まで含む）を待つ
+    while processing_thread.is_alive():
+        processing_thread.join(1)
+    
+    stop_control_server()
+    return 0
+
+#=======================================================================
+# ジョブのトレース・プロファイル
+#=======================================================================
+
+def is_tracing():
+    """現在のスレッドでジョブのトレースを記録中か"""
+    return getattr(trace_local, "trace", None) is not None
+
+def start_job_trace(job):
+    """ジョブのトレースを開始（trace_file未設定なら何もしない）"""
+    if not config.get("trace_file"):
+        trace_local.trace = None
+        return
+    
+    trace_local.trace = {
+        "job_id": job["id"],
+        "file": job["name"],
+        "worker": threading.current_thread().name,
+        "attempt": job["attempts"],
+        "queued_at": job["queued_at"],
+        "started_at": time.time(),
+        "stages": {}
+    }
+
+@contextlib.contextmanager
+def trace_stage(name):
+    """処理段階の所要時間をトレースに積算（トレースしていなければ何もしない）"""
+    trace = getattr(trace_local, "trace", None)
+    if trace is None:
+        yield
+        return
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = trace["stages"]
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+
+def trace_set(key, value):
+    """トレースに値を記録（トレースしていなければ何もしない）"""
+    trace = getattr(trace_local, "trace", None)
+    if trace is not None:
+        trace[key] = value
+
+def finish_job_trace():
+    """ジョブのトレースをJSONLファイルに1行追記"""
+    trace = getattr(trace_local, "trace", None)
+    trace_local.trace = None
+    if trace is None:
+        return
+    
+    finished_at = time.time()
+    trace["finished_at"] = finished_at
+    trace["total_seconds"] = round(finished_at - trace["started_at"], 4)
+    trace["stages"] = {name: round(seconds, 4) for name, seconds in trace["stages"].items()}
+    trace["state"] = get_job_state(trace["job_id"])
+    audio_seconds = trace.get("audio_seconds")
+    if audio_seconds:
+        trace["rtf"] = round(trace["total_seconds"] / audio_seconds, 4)
+    
+    try:
+        with trace_lock, open(config.get("trace_file"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+    except OSError as e:
+        log_and_print(f"トレースを書き込めません: {e}", "warning", category="システム")
+
+@contextlib.contextmanager
+def profile_job(job):
+    """profile_dir設定時、ジョブの処理をcProfileで計測して.profに保存
+    
+    Python 3.11以前は呼び出したワーカースレッドのみが計測対象だが、3.12以降はsys.monitoringを使うため
+    プロセス全体が対象になり、2つ目のプロファイラは有効にできない。そのため同時に計測するのは1ジョブだけとし、
+    他のジョブの計測中に始まったジョブは計測せずに処理する（3.12以降は他のスレッドの処理も結果に含まれる）。
+    """
+    profile_dir = config.get("profile_dir")
+    if not profile_dir or not profile_lock.acquire(blocking=False):
+        yield
+        return
+    
+    import cProfile
+    
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # 他のプロファイラ・デバッガが有効
+        profile_lock.release()
+        logger.debug(f"プロファイルを取得できません: {job['name']} - {e}")
+        yield
+        return
+    
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile_lock.release()
+        ensure_directory(profile_dir)
+        profile_path = os.path.join(profile_dir, f"job{job['id']}_{Path(job['name']).stem}.prof")
+        profiler.dump_stats(profile_path)
+        logger.debug(f"プロファイルを保存しました: {profile_path}")
+
+#=======================================================================
+# メトリクス（Prometheus形式）
+#=======================================================================
+
+# 投入から完了までの時間のヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 7200, 14400, 43200, 86400)
+
+metrics_lock = threading.Lock()
+metrics = {
+    "jobs_total": {"done": 0, "failed": 0},
+    "latency_buckets": [0] * len(LATENCY_BUCKETS),
+    "latency_sum": 0.0,
+    "latency_count": 0,
+    "audio_seconds": {},        # モデル -> 推論した音声の秒数
+    "transcribe_seconds": {},   # モデル -> 推論にかかった秒数
+    "model_load_seconds": {},   # (モデル, compute_type) -> 直近のロード時間
+    "resource_wait_seconds": 0.0,
+    "silent_files": 0,  # 無音と判定してモデルを使わなかったファイル数
+    "silence_skipped_seconds": 0.0,  # 無音の判定・切り詰めで推論せずに済んだ音声の秒数
+    "unstable_files": 0  # 書き込み中のためキュー追加を見送ったファイル数
+}
+
+def observe_job_finished(state, latency=None):
+    """ジョブの完了・失敗を記録（完了時は投入から完了までの時間も記録）"""
+    with metrics_lock:
+        metrics["jobs_total"][state] += 1
+        if latency is None:
+            return
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                metrics["latency_buckets"][index] += 1
+        metrics["latency_sum"] += latency
+        metrics["latency_count"] += 1
+
+def observe_transcription(model_size, audio_seconds, transcribe_seconds):
+    """推論した音声の長さと処理時間を記録（RTFの算出用）"""
+    with metrics_lock:
+        metrics["audio_seconds"][model_size] = metrics["audio_seconds"].get(model_size, 0.0) + audio_seconds
+        metrics["transcribe_seconds"][model_size] = metrics["transcribe_seconds"].get(model_size, 0.0) + transcribe_seconds
+
+def observe_model_load(model_size, compute_type, seconds):
+    """モデルのロード時間を記録"""
+    with metrics_lock:
+        metrics["model_load_seconds"][(model_size, compute_type)] = seconds
+
+def observe_silence(skipped_seconds, silent):
+    """無音の事前判定で推論を省いた音声の秒数を記録"""
+    with metrics_lock:
+        metrics["silent_files"] += int(silent)
+        metrics["silence_skipped_seconds"] += skipped_seconds
+
+def observe_unstable_file():
+    """書き込み中のためキュー追加を見送ったファイルを記録"""
+    with metrics_lock:
+        metrics["unstable_files"] += 1
+
+def observe_resource_wait(seconds):
+    """リソース待ちに費やした時間を記録"""
+    with metrics_lock:
+        metrics["resource_wait_seconds"] += seconds
+
+def format_metric_labels(labels):
+    """ラベルをPrometheusの書式にする"""
+    if not labels:
+        return ""
+    escaped = [f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels.items()]
+    return "{" + ",".join(escaped) + "}"
+
+def render_metrics():
+    """メトリクスをPrometheusのテキスト形式で出力"""
+    lines = []
+    
+    def add(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{format_metric_labels(labels)} {value}")
+    
+    with metrics_lock:
+        snapshot = copy.deepcopy(metrics)
+    model_load = snapshot["model_load_seconds"]
+    
+    add("koemoji_queue_depth", "gauge", "Jobs waiting to be transcribed",
+        [({}, count_jobs("queued"))])
+    add("koemoji_jobs_in_flight", "gauge", "Jobs currently being transcribed",
+        [({}, count_jobs("running"))])
+    add("koemoji_workers", "gauge", "Running worker threads",
+        [({}, sum(1 for thread in worker_threads if thread.is_alive()))])
+    add("koemoji_jobs_total", "counter", "Finished jobs by result",
+        [({"state": state}, count) for state, count in snapshot["jobs_total"].items()])
+    
+    # 投入（キュー登録）から完了までの時間
+    lines.append("# HELP koemoji_job_latency_seconds Time from queueing to finished transcript")
+    lines.append("# TYPE koemoji_job_latency_seconds histogram")
+    for bound, count in zip(LATENCY_BUCKETS, snapshot["latency_buckets"]):
+        lines.append(f'koemoji_job_latency_seconds_bucket{{le="{bound}"}} {count}')
+    lines.append(f'koemoji_job_latency_seconds_bucket{{le="+Inf"}} {snapshot["latency_count"]}')
+    lines.append(f"koemoji_job_latency_seconds_sum {snapshot['latency_sum']}")
+    lines.append(f"koemoji_job_latency_seconds_count {snapshot['latency_count']}")
+    
+    add("koemoji_audio_seconds_total", "counter", "Audio seconds transcribed by model",
+        [({"model": model}, value) for model, value in snapshot["audio_seconds"].items()])
+    add("koemoji_transcribe_seconds_total", "counter", "Wall-clock seconds spent transcribing by model",
+        [({"model": model}, value) for model, value in snapshot["transcribe_seconds"].items()])
+    add("koemoji_real_time_factor", "gauge", "Transcribe seconds per audio second by model",
+        [({"model": model}, snapshot["transcribe_seconds"][model] / audio)
+         for model, audio in snapshot["audio_seconds"].items() if audio])
+    add("koemoji_model_load_seconds", "gauge", "Duration of the most recent model load",
+        [({"model": model, "compute_type": compute_type}, seconds)
+         for (model, compute_type), seconds in model_load.items()])
+    add("koemoji_resource_wait_seconds_total", "counter", "Seconds workers held back by admission control",
+        [({}, snapshot["resource_wait_seconds"])])
+    add("koemoji_silent_files_total", "counter", "Files classified as silent without running the model",
+        [({}, snapshot["silent_files"])])
+    add("koemoji_silence_skipped_seconds_total", "counter", "Audio seconds skipped by the silence pre-pass",
+        [({}, snapshot["silence_skipped_seconds"])])
+    add("koemoji_unstable_files_total", "counter", "Files held back because they were still being written",
+        [({}, snapshot["unstable_files"])])
+    with pending_lock:
+        pending_count = len(pending_files)
+    add("koemoji_pending_files", "gauge", "Files waiting for their size and mtime to settle",
+        [({}, pending_count)])
+    
+    resources = get_resource_snapshot()
+    add("koemoji_cpu_percent", "gauge", "Smoothed host CPU utilisation",
+        [({}, resources["cpu_percent"])] if "cpu_percent" in resources else [])
+    add("koemoji_memory_available_bytes", "gauge", "Available host memory",
+        [({}, int(resources["memory_available_mb"] * 1024 * 1024))] if "memory_available_mb" in resources else [])
+    add("koemoji_load_average", "gauge", "One-minute load average",
+        [({}, resources["load_average"])] if resources.get("load_average") is not None else [])
+    
+    with stats_lock:
+        cache_hits, cache_misses = cache_stats["hit"], cache_stats["miss"]
+    add("koemoji_cache_requests_total", "counter", "Transcript cache lookups by result",
+        [({"result": "hit"}, cache_hits), ({"result": "miss"}, cache_misses)])
+    
+    return "\n".join(lines) + "\n"
+
+#=======================================================================
+# ローカルHTTPサーバー
+#=======================================================================
+
+def get_job_status(job):
+    """HTTP APIで返すジョブの状態"""
+    status = {key: job[key] for key in ("id", "name", "state", "attempts", "queued_at",
+                                         "started_at", "finished_at", "duration", "model", "error")}
+    if job["state"] == "done":
+        status["transcript_url"] = f"/jobs/{job['id']}/transcript"
+    return status
+
+def wait_for_job(job_id, timeout):
+    """ジョブが完了・失敗するまで最大timeout秒待つ"""
+    def is_finished():
+        job = get_job(job_id)
+        return job is None or job["state"] in ("done", "failed")
+    
+    with job_finished_cond:
+        job_finished_cond.wait_for(lambda: is_finished() or stop_requested, timeout)
+    return get_job(job_id)
+
+def save_upload(stream, length, file_name):
+    """アップロードされた音声をメモリに溜めずにupload_folderへ書き出し、保存先のパスを返す"""
+    upload_folder = config.get("upload_folder")
+    ensure_directory(upload_folder)
+    
+    # 同名ファイルが何度送られても出力ファイルが衝突しないよう一意な接頭辞を付ける
+    file_path = os.path.join(upload_folder, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}-{file_name}")
+    temp_path = file_path + ".uploading"
+    
+    remaining = length
+    try:
+        with open(temp_path, 'wb') as f:
+            while remaining > 0:
+                chunk = stream.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    raise ValueError("アップロードが途中で切断されました")
+                f.write(chunk)
+                remaining -= len(chunk)
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    
+    return file_path
+
+class KoemojiRequestHandler(BaseHTTPRequestHandler):
+    """ローカルHTTPサーバーのリクエスト処理
+    
+    GET  /metrics                  Prometheus形式のメトリクス
+    POST /jobs?filename=NAME       音声ファイルを送信してジョブを登録
+    GET  /jobs/ID?wait=SECONDS     ジョブの状態（waitを指定すると完了まで最大SECONDS秒待つ）
+    GET  /jobs/ID/transcript       文字起こし結果
+    """
+    
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        
+        if url.path == "/metrics":
+            self.send_text(200, render_metrics(), "text/plain; version=0.0.4; charset=utf-8")
+        elif parts[0] == "jobs" and len(parts) in (2, 3) and parts[1].isdigit():
+            if len(parts) == 2:
+                self.send_job_status(int(parts[1]), parse_qs(url.query))
+            elif parts[2] == "transcript":
+                self.send_transcript(int(parts[1]))
+            else:
+                self.send_text(404, "not found\n")
+        else:
+            self.send_text(404, "not found\n")
+    
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/jobs":
+            self.send_text(404, "not found\n")
+            return
+        
+        if job_db is None or not is_running:
+            self.send_json(503, {"error": "文字起こし処理が開始されていません"})
+            return
+        
+        file_name = os.path.basename(parse_qs(url.query).get("filename", [""])[0]
+                                     or self.headers.get("X-Filename", ""))
+        if not file_name.lower().endswith(MEDIA_EXTENSIONS):
+            self.send_json(415, {"error": f"対応していない形式です: {file_name or '(ファイル名なし)'}"})
+            return
+        
+        length = self.headers.get("Content-Length")
+        if length is None or not length.isdigit():
+            self.send_json(411, {"error": "Content-Lengthが必要です"})
+            return
+        length = int(length)
+        if length > config.get("upload_max_mb", 2048) * 1024 * 1024:
+            self.send_json(413, {"error": "ファイルサイズが上限を超えています"})
+            return
+        
+        try:
+            file_path = save_upload(self.rfile, length, file_name)
+        except (OSError, ValueError) as e:
+            log_and_print(f"アップロードの保存に失敗しました: {file_name} - {e}", "error", category="キュー")
+            self.send_json(400, {"error": str(e)})
+            return
+        
+        file_info = queue_file(file_path, source="http")
+        if file_info is None:
+            os.remove(file_path)
+            self.send_json(503, {"error": "新しいジョブを受け付けていません"})
+            return
+        
+        self.send_json(202, {"id": file_info["id"], "state": "queued",
+                             "status_url": f"/jobs/{file_info['id']}"})
+    
+    def send_job_status(self, job_id, query):
+        job = get_job(job_id) if job_db is not None else None
+        if job is None:
+            self.send_json(404, {"error": "ジョブが見つかりません"})
+            return
+        
+        # ロングポーリング（完了済みなら待たずに返す）
+        try:
+            wait = min(float(query.get("wait", ["0"])[0]), 300)
+        except ValueError:
+            wait = 0
+        if wait > 0 and job["state"] not in ("done", "failed"):
+            job = wait_for_job(job_id, wait)
+        
+        self.send_json(200, get_job_status(job))
+    
+    def send_transcript(self, job_id):
+        job = get_job(job_id) if job_db is not None else None
+        if job is None:
+            self.send_json(404, {"error": "ジョブが見つかりません"})
+        elif job["state"] != "done":
+            self.send_json(409, get_job_status(job))
+        elif not job["output_path"] or not os.path.exists(job["output_path"]):
+            self.send_json(410, {"error": "出力ファイルが見つかりません"})
+        else:
+            with open(job["output_path"], 'r', encoding='utf-8') as f:
+                self.send_text(200, f.read())
+    
+    def send_json(self, status, data):
+        self.send_text(status, json.dumps(data, ensure_ascii=False) + "\n", "application/json; charset=utf-8")
+    
+    def send_text(self, status, text, content_type="text/plain; charset=utf-8"):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # アクセスログはコンソールに出さずデバッグログへ
+        logger.debug(f"HTTP {self.address_string()} - {format % args}")
+
+def start_http_server():
+    """ローカルHTTPサーバーを開始（http_portが0なら何もしない）"""
+    global http_server
+    
+    port = config.get("http_port", 0)
+    if not port or http_server is not None:
+        return
+    
+    host = config.get("http_host", "127.0.0.1")
+    try:
+        http_server = ThreadingHTTPServer((host, port), KoemojiRequestHandler)
+    except OSError as e:
+        log_and_print(f"HTTPサーバーを開始できません: {host}:{port} - {e}", "error", category="システム")
+        return
+    
+    thread = threading.Thread(target=http_server.serve_forever, name="koemoji-http")
+    thread.daemon = True
+    thread.start()
+    log_and_print(f"HTTPサーバーを開始しました: http://{host}:{port}/ (/metrics, /jobs)", category="システム", print_console=False)
+
+#=======================================================================
+# CLI インターフェース
+#=======================================================================
+
+def clear_screen():
+    """画面をクリアしてタイトルを設定"""
+    if IS_WINDOWS:
         os.system('cls')
         os.system('title KoeMoji')
     else:
@@ -555,18 +3724,28 @@ def clear_screen():
         sys.stdout.write('\033]0;KoeMoji\007')
         sys.stdout.flush()
 
+def read_last_lines(file_path, lines, block_size=4096):
+    """ファイル末尾からブロック単位で読み、最後のN行を返す（ファイルサイズによらず末尾数KBのみ読む）"""
+    with open(file_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        
+        # 必要な行数の改行が見つかるまで、末尾から1ブロックずつさかのぼる
+        while position > 0 and data.count(b"\n") <= lines:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+    
+    return data.decode('utf-8', errors='replace').splitlines()[-lines:]
+
 def show_recent_logs(lines=15):
     """最新のログを表示"""
-    log_path = 'koemoji.log'
     if os.path.exists(log_path):
         try:
-            with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
-                # 最後のN行だけを保持（メモリ効率的）
-                recent_lines = deque(f, maxlen=lines)
-                
-                for line in recent_lines:
-                    print(line.strip())
-                    
+            for line in read_last_lines(log_path, lines):
+                print(line.strip())
         except Exception as e:
             print(f"ログ読み込みエラー: {e}")
     else:
@@ -578,12 +3757,25 @@ def get_status_display():
     status_symbol = "●" if is_running else "○"
     return f"{status_symbol} {status}"
 
+def show_worker_status():
+    """ワーカーごとの処理状況を表示"""
+    if not is_running or not worker_status:
+        return
+    
+    print(f"キュー: {count_jobs('queued')}件待機中 / 完了: {completed_count}件")
+    resources = get_resource_snapshot()
+    if resources:
+        print(f"CPU: {resources['cpu_percent']:.0f}% / 空きメモリ: {resources['memory_available_mb']:.0f}MB")
+    for worker_id in sorted(worker_status):
+        print(f"  ワーカー{worker_id}: {worker_status[worker_id]}")
+
 def display_menu():
     """メニューを表示"""
     print("=" * 40)
     print("        K O E M O J I - A U T O")
     print("=" * 40)
     print(f"状態: {get_status_display()}")
+    show_worker_status()
     print("-" * 40)
     print("  1. 開始      - 文字起こしを開始")
     print("  2. 設定表示  - 現在の設定を確認")
@@ -597,6 +3789,7 @@ def display_auto_mode():
         print("    K O E M O J I - A U T O (自動実行中)")
         print("=" * 40)
         print(f"状態: {get_status_display()}")
+        show_worker_status()
         print("-" * 40)
         print("\n最新ログ:")
         print("-" * 40)
@@ -612,6 +3805,11 @@ def display_cli():
     
     # auto_start チェック
     if config.get("auto_start", False):
+        # 端末がない（systemd・nohupなど）場合は画面を描き直さず常駐モードで動かす
+        if not sys.stdout.isatty():
+            run_daemon()
+            return
+        
         log_and_print("自動実行モードで起動しました", category="システム")
         if start_processing():
             try:
@@ -661,13 +3859,70 @@ def display_cli():
 # メイン実行部分
 #=======================================================================
 
+def parse_arguments():
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="KoeMoji 自動文字起こし")
+    parser.add_argument("--config", default="config.json", help="設定ファイルのパス")
+    parser.add_argument("--daemon", action="store_true",
+                        help="画面表示なしで常駐実行（systemdなどのサービス向け）")
+    parser.add_argument("--ctl", nargs="+", metavar="COMMAND",
+                        help="稼働中のKoeMojiを操作: status / pause / resume / drain / enqueue PATH / stop")
+    parser.add_argument("--import-model", metavar="MODEL",
+                        help="モデルをモデルストアに取り込む（例: large-v3）")
+    parser.add_argument("--source", metavar="PATH_OR_ID",
+                        help="--import-modelの取り込み元（CTranslate2/Transformers形式のフォルダ、Hugging FaceのID）")
+    parser.add_argument("--compute-type", metavar="TYPE",
+                        help="--import-modelで量子化するcompute_type（省略時は設定値）")
+    parser.add_argument("--verify-models", action="store_true",
+                        help="モデルストアのモデルをハッシュで検証する")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_arguments()
+    
+    if args.ctl:
+        # 制御コマンドの送信のみ（ログ出力・フォルダ作成をせず、ソケットのパスだけ読む）
+        config = DEFAULT_CONFIG.copy()
+        if os.path.exists(args.config):
+            with open(args.config, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+        command = args.ctl
+        if command[0] == "enqueue" and len(command) > 1:
+            # 常駐中のKoeMojiとは作業フォルダが異なるため、このプロセスの作業フォルダを基準に絶対パスにする
+            command = ["enqueue", os.path.abspath(" ".join(command[1:]))]
+        try:
+            response = send_control_command(" ".join(command))
+        except (OSError, RuntimeError) as e:
+            print(f"KoeMojiに接続できません: {e}")
+            sys.exit(1)
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+        sys.exit(0 if response.get("ok") else 1)
+    
+    if args.import_model or args.verify_models:
+        setup_logging()
+        load_config(args.config)
+        if args.verify_models:
+            sys.exit(0 if verify_model_store() else 1)
+        try:
+            import_model(args.import_model, args.compute_type or config.get("compute_type", "int8"), args.source)
+        except Exception as e:
+            log_and_print(f"モデルの取り込みに失敗しました: {e}", "error", category="モデル")
+            sys.exit(1)
+        sys.exit(0)
+    
+    if args.daemon:
+        setup_logging()
+        load_config(args.config)
+        setup_logging()  # ログのローテーション設定を反映
+        sys.exit(run_daemon())
+    
     try:
         # ロギング設定
         setup_logging()
         
         # 設定を読み込む
-        load_config()
+        load_config(args.config)
+        setup_logging()  # ログのローテーション設定を反映
         
         # CLIを起動
         display_cli()
@@ -19,8 +19,8 @@ def main():
     print("KOEMOJI Starting...")
     
     try:
-        # Pythonスクリプトを実行
-        subprocess.run([sys.executable, "koemoji.py"])
+        # Pythonスクリプトを実行（--daemon などの引数はそのまま渡す）
+        subprocess.run([sys.executable, "koemoji.py"] + sys.argv[1:])
     except KeyboardInterrupt:
         print("\nKoeMoji stopped by user")
     except Exception as e:
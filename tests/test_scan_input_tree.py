@@ -0,0 +1,111 @@
+"""入力フォルダの索引（scan_input_tree）の回帰テスト
+
+実行: python -m unittest discover tests
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import koemoji
+
+
+class ScanInputTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.input_folder = os.path.join(self.root, "input")
+        os.makedirs(os.path.join(self.input_folder, "営業部"))
+
+        koemoji.logger = logging.getLogger("koemoji-test")
+        koemoji.config = dict(koemoji.DEFAULT_CONFIG, input_folder=self.input_folder,
+                              job_db=os.path.join(self.root, "jobs.db"), file_settle_seconds=0)
+        koemoji.job_db = None
+        koemoji.init_job_store()
+        koemoji.is_draining = False
+        koemoji.pending_files.clear()
+
+    def tearDown(self):
+        koemoji.job_db.close()
+        koemoji.job_db = None
+        koemoji.is_draining = False
+        koemoji.pending_files.clear()
+        shutil.rmtree(self.root)
+
+    def add_file(self, name, folder="営業部"):
+        path = os.path.join(self.input_folder, folder, name)
+        with open(path, "wb") as f:
+            f.write(b"\0" * 1024)
+        return path
+
+    def test_candidate_is_reported_until_queued(self):
+        path = self.add_file("会議.wav")
+        self.add_file("メモ.txt")
+
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+        # キューに登録するまでは毎回候補になる
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+
+        self.assertIsNotNone(koemoji.queue_file(path))
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [])
+
+    def test_pending_file_is_reported_until_settled(self):
+        koemoji.config["file_settle_seconds"] = 0.2
+        path = self.add_file("会議.wav")
+
+        koemoji.scan_and_queue_files()
+        self.assertIn(path, koemoji.pending_files)
+        self.assertEqual(koemoji.count_jobs("queued"), 0)
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+
+        time.sleep(0.3)
+        koemoji.check_pending_files()
+        self.assertNotIn(path, koemoji.pending_files)
+        self.assertEqual(koemoji.count_jobs("queued"), 1)
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [])
+
+    def test_files_found_while_draining_are_kept_for_later(self):
+        path = self.add_file("会議.wav")
+
+        koemoji.is_draining = True
+        koemoji.scan_and_queue_files()
+        self.assertEqual(koemoji.count_jobs("queued"), 0)
+
+        # 終了待ちの間に見送ったファイルは、次の起動時のスキャンで拾う
+        koemoji.is_draining = False
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+        koemoji.scan_and_queue_files()
+        self.assertEqual(koemoji.count_jobs("queued"), 1)
+
+    def test_file_moved_away_and_back_is_reported_again(self):
+        path = self.add_file("会議.wav")
+        outside = os.path.join(self.root, "会議.wav")
+        job = koemoji.queue_file(path)
+        koemoji.finish_job(job["id"], "done")
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [])
+
+        # スキャンの間に移動して戻した（サイズ・mtimeは変わらない）
+        os.rename(path, outside)
+        os.rename(outside, path)
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+
+        # 移動した後のスキャンで索引から消え、戻したときに再び候補になる
+        koemoji.queue_file(path)
+        os.rename(path, outside)
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [])
+        os.rename(outside, path)
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [path])
+
+    def test_hidden_folders_are_skipped(self):
+        os.makedirs(os.path.join(self.input_folder, ".processing"))
+        self.add_file("確保済み.wav", folder=".processing")
+
+        self.assertEqual(koemoji.scan_input_tree(self.input_folder), [])
+
+
+if __name__ == "__main__":
+    unittest.main()